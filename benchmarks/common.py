@@ -0,0 +1,61 @@
+# Timing and input helpers shared by the benchmarks.
+import os
+import time
+import numpy as np
+from scipy import ndimage
+from src.dag_storage import load_dag
+
+
+def timed(function, repeats=1):
+    # result of the last call and the shortest of its run times
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return result, min(times)
+
+
+def compare(name, loop, fast, label='sparse', equal=np.array_equal, width=26):
+    expected, loop_time = timed(loop)
+    result, fast_time = timed(fast)
+    print(f'{name:{width}s} loop {loop_time:8.3f} s   {label} {fast_time:8.3f} s   '
+          f'({loop_time / fast_time:6.1f}x)   equal: {equal(expected, result)}')
+
+
+def load_central_line(path):
+    if path.endswith('.npy'):
+        return (np.load(path) > 0).astype(np.uint8)
+    dag = load_dag(path, lazy=False)
+    central_line = np.zeros(dag.volume_shape, dtype=np.uint8)
+    central_line[tuple(np.concatenate([dag.node_voxels, dag.edge_voxels]).T)] = 1
+    return central_line
+
+
+def load_specimen(directory, slices):
+    # skeleton and reconstruction of the first slices of a specimen
+    try:
+        skeleton = np.load(os.path.join(directory, 'central-line.npy'), mmap_mode='r')[:slices] > 0
+        reconstruction = np.load(os.path.join(directory, 'reconstruction.npy'), mmap_mode='r')[:slices] > 0
+        return skeleton, reconstruction
+    except FileNotFoundError:
+        pass
+
+    dag = load_dag(os.path.join(directory, 'dag.pkl'), lazy=False)
+    voxels = np.concatenate([dag.node_voxels, dag.edge_voxels])
+    radii = np.concatenate([np.repeat(dag.node_columns['radius'], np.diff(dag.node_voxel_offsets)),
+                            dag.edge_voxel_columns['radii_list']])
+    start = voxels.min(axis=0)
+    in_crop = voxels[:, 0] < start[0] + slices
+    margin = int(np.ceil(radii.max()))
+    voxels, radii = voxels[in_crop] - start + margin, radii[in_crop]
+    shape = tuple(voxels.max(axis=0) + margin + 1)
+
+    skeleton = np.zeros(shape, dtype=bool)
+    skeleton[tuple(voxels.T)] = True
+    radius_map = np.zeros(shape, dtype=np.float32)
+    radius_map[tuple(voxels.T)] = radii
+    # union of balls around the central line, each voxel belonging to its nearest central line voxel
+    distances, nearest = ndimage.distance_transform_edt(~skeleton, return_indices=True)
+    reconstruction = distances < radius_map[tuple(nearest)]
+    return skeleton, reconstruction
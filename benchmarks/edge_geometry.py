@@ -0,0 +1,50 @@
+# Compares the batched edge geometry kernel with the per-edge loop it replaced.
+# usage: python -m benchmarks.edge_geometry [graph file] [repeats]
+import sys
+import numpy as np
+from benchmarks.common import timed
+from src.dag_storage import load_dag
+from src.edge_geometry import calculate_edges_geometry
+from src.utils import calculate_vectors_relative_angle, calculate_direction
+
+WEIGHTS = [1, 1, 1, 1, 1, 0.8, 0.8, 0.6, 0.2]
+
+
+def per_edge_geometry(dag, weights):
+    centroids, start_directions, end_directions, tortuosities = [], [], [], []
+    for edge in dag.edges:
+        start_point = edge.node_a['centroid']
+        end_point = edge.node_b['centroid']
+        centroids.append(np.mean(edge['voxels'], axis=0))
+        start_directions.append(calculate_direction(start_point, edge['voxels'], weights))
+        end_directions.append(calculate_direction(end_point, np.flip(edge['voxels'], axis=0), weights) * (-1))
+        tortuosities.append(edge['length'] / np.linalg.norm(end_point - start_point))
+
+    relative_angles = [0] * dag.number_of_edges
+    for i, parent in enumerate(dag.parent_edges()):
+        if parent >= 0:
+            relative_angles[i] = calculate_vectors_relative_angle(end_directions[parent], start_directions[i])
+
+    return {
+        'centroid': np.array(centroids),
+        'start_direction': np.array(start_directions),
+        'end_direction': np.array(end_directions),
+        'relative_angle': np.array(relative_angles, dtype=float),
+        'tortuosity': np.array(tortuosities),
+    }
+
+
+if __name__ == '__main__':
+    graph_path = sys.argv[1] if len(sys.argv) > 1 else 'data/P32/dag.pkl'
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    dag = load_dag(graph_path, lazy=False)
+    print(f'{graph_path}: {dag.number_of_edges} edges, {len(dag.edge_voxels)} edge voxels')
+
+    expected, loop_time = timed(lambda: per_edge_geometry(dag, WEIGHTS), repeats)
+    result, batched_time = timed(lambda: calculate_edges_geometry(dag, WEIGHTS), repeats)
+
+    print(f'per-edge loop: {loop_time * 1000:9.2f} ms')
+    print(f'batched:       {batched_time * 1000:9.2f} ms  ({loop_time / batched_time:.1f}x)')
+    for key in expected:
+        print(f'max abs difference {key:16s} {np.nanmax(np.abs(expected[key] - result[key])):.3e}')
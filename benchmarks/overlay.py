@@ -0,0 +1,83 @@
+# Compares the batched overlay rasteriser with the drawing helpers of the final-3 and final-4 notebooks.
+# usage: python -m benchmarks.overlay [graph file]
+# The notebook helpers draw into uint8 volumes here (float64 ones of a whole specimen do not fit in memory),
+# tubes are compared with one full ball per centre line voxel.
+import sys
+import numpy as np
+from skimage import morphology
+from skimage.draw import line_nd
+from benchmarks.common import compare
+from src.dag_storage import load_dag
+from src.dag_visualizer import DAG_Visualizer
+
+
+def loop_draw_nodes(image, nodes, value, size=None):
+    radii = [int(node['radius']) if size is None else size for node in nodes]
+    max_kernel_radius = max(radii)
+    kernels = [morphology.ball(radius) for radius in range(max_kernel_radius + 1)]
+    kernels_image = np.zeros(tuple(s + 2 * max_kernel_radius for s in image.shape), dtype=bool)
+    for node, kernel_radius in zip(nodes, radii):
+        x, y, z = (coord + max_kernel_radius for coord in node.coords)
+        mask_slice = kernels_image[
+            x-kernel_radius:x+kernel_radius + 1,
+            y-kernel_radius:y+kernel_radius + 1,
+            z-kernel_radius:z+kernel_radius + 1
+        ]
+        mask_slice[:] = np.logical_or(mask_slice, kernels[kernel_radius])
+    image[kernels_image[max_kernel_radius:-max_kernel_radius,
+                        max_kernel_radius:-max_kernel_radius,
+                        max_kernel_radius:-max_kernel_radius]] = value
+    return image
+
+
+def loop_draw_edges(image, edges, value='mean_radius', interpolate=True):
+    for edge in edges:
+        fill_value = np.clip(edge[value] if type(value) == str else value, 0, 255)
+        if interpolate:
+            image[line_nd(edge.node_a.coords, edge.node_b.coords)] = fill_value
+        else:
+            for v in edge['voxels']:
+                image[tuple(v)] = fill_value
+    return image
+
+
+def loop_draw_central_line(image, dag):
+    image = loop_draw_edges(image, dag.edges, value=1, interpolate=False)
+    for n in dag.nodes:
+        for v in n['voxels']:
+            image[tuple(v)] = 1
+    return image
+
+
+def loop_draw_tubes(image, dag):
+    radii = dag.edge_voxel_columns['radii_list'].astype(int)
+    margin = radii.max()
+    kernels_image = np.zeros(tuple(s + 2 * margin for s in image.shape), dtype=bool)
+    for voxel, radius in zip(dag.edge_voxels.astype(int), radii):
+        x, y, z = voxel + margin
+        mask_slice = kernels_image[x-radius:x+radius + 1, y-radius:y+radius + 1, z-radius:z+radius + 1]
+        mask_slice |= morphology.ball(radius) > 0
+    image[kernels_image[margin:-margin, margin:-margin, margin:-margin]] = 1
+    return image
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'data/P32/dag.pkl'
+    dag = load_dag(path, lazy=False)
+    objects = dag.to_dag()
+    print(f'{path}: volume {dag.volume_shape}, {dag.number_of_nodes} nodes, {dag.number_of_edges} edges')
+
+    compare('node balls', lambda: loop_draw_nodes(DAG_Visualizer.overlay_volume(dag), objects.nodes, 25),
+            lambda: DAG_Visualizer.draw_node_balls(DAG_Visualizer.overlay_volume(dag), dag, 25), 'batched', width=22)
+    compare('node balls (radius 3)', lambda: loop_draw_nodes(DAG_Visualizer.overlay_volume(dag), objects.nodes, 4, 3),
+            lambda: DAG_Visualizer.draw_node_balls(DAG_Visualizer.overlay_volume(dag), dag, 4, 3), 'batched', width=22)
+    compare('edge lines', lambda: loop_draw_edges(DAG_Visualizer.overlay_volume(dag), objects.edges, 'mean_radius'),
+            lambda: DAG_Visualizer.draw_edge_lines(DAG_Visualizer.overlay_volume(dag), dag, 'mean_radius'),
+            'batched', width=22)
+    compare('central line', lambda: loop_draw_central_line(DAG_Visualizer.overlay_volume(dag), objects),
+            lambda: DAG_Visualizer.draw_central_line(DAG_Visualizer.overlay_volume(dag), dag), 'batched', width=22)
+    # the kernel bank is filled by the first call, the second one shows the cost of drawing alone
+    for name in ('edge tubes', 'edge tubes (cached)'):
+        compare(name, lambda: loop_draw_tubes(DAG_Visualizer.overlay_volume(dag), dag),
+                lambda: DAG_Visualizer.draw_edge_tubes(DAG_Visualizer.overlay_volume(dag), dag, 1), 'batched',
+                equal=lambda a, b: np.array_equal(a > 0, b > 0), width=22)
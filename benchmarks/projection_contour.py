@@ -0,0 +1,65 @@
+# Compares the erosion based projection contour with the per-pixel loop it replaced
+# and reports the box-counting fractal dimension of the contour.
+# usage: python -m benchmarks.projection_contour [reconstruction file | graph file] [repeats]
+# A graph file is projected from its centre-line voxels when the reconstruction is not available.
+import sys
+import numpy as np
+from scipy.ndimage import binary_dilation
+from benchmarks.common import timed
+from src.dag_storage import load_dag
+from src.volume_io import load_reconstruction, iter_slabs
+from src.projection_metrics import projection_contour, box_counting_fit
+
+
+def loop_projection_contour(projection_mask):
+    padded_projection = np.pad(projection_mask, 1)
+    contour = np.zeros(padded_projection.shape)
+    projection_pixels = np.argwhere(padded_projection)
+    kernel = np.ones((3, 3))
+    kernel[1, 1] = 0
+    for pixel in projection_pixels:
+        x, y = tuple(pixel)
+        projection_slice = padded_projection[x-1 : x+2, y-1 : y+2]
+        if np.sum(projection_slice * kernel) < 8:
+            contour[x, y] = 1
+    return contour[1:-1, 1:-1]
+
+
+def project(coords):
+    centered = coords - coords.mean(axis=0)
+    _, _, components = np.linalg.svd(centered, full_matrices=False)
+    projection = np.round(centered @ components[:2].T)
+    projection = (projection - projection.min(axis=0)).astype(np.int64)
+    mask = np.zeros(projection.max(axis=0) + 1, dtype=bool)
+    mask[projection[:, 0], projection[:, 1]] = True
+    return mask
+
+
+def load_projection_mask(path):
+    if path.endswith('.npy') or path.endswith('.bits'):
+        volume = load_reconstruction(path, mmap_mode='r')
+        return project(np.concatenate([np.argwhere(slab) + [start, 0, 0] for start, slab in iter_slabs(volume)]))
+    dag = load_dag(path, lazy=False)
+    # centre-line only, thickened to resemble a projected reconstruction
+    return binary_dilation(project(np.concatenate([dag.node_voxels, dag.edge_voxels])), iterations=3)
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'data/P32/reconstruction.npy'
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    try:
+        mask = load_projection_mask(path)
+    except FileNotFoundError:
+        path = 'data/P32/dag.pkl'
+        mask = load_projection_mask(path)
+    print(f'{path}: projection {mask.shape}, {np.count_nonzero(mask)} foreground pixels')
+
+    expected, loop_time = timed(lambda: loop_projection_contour(mask), repeats)
+    contour, vectorised_time = timed(lambda: projection_contour(mask), repeats)
+    print(f'per-pixel loop: {loop_time * 1000:9.2f} ms')
+    print(f'erosion:        {vectorised_time * 1000:9.2f} ms  ({loop_time / vectorised_time:.0f}x)')
+    print(f'contours equal: {np.array_equal(expected > 0, contour)}')
+
+    fit, box_counting_time = timed(lambda: box_counting_fit(contour), repeats)
+    print(f'box counting:   {box_counting_time * 1000:9.2f} ms, fractal dimension {fit["dimension"]:.4f}')
+    print(f'box sizes {fit["box_sizes"].tolist()}, counts {fit["counts"].tolist()}')
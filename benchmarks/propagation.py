@@ -0,0 +1,63 @@
+# Compares thickness propagation over the sparse neighbour table with the list queue of the final-2 notebook.
+# usage: python -m benchmarks.propagation [central line file | graph file] [slices] [trim iterations]
+# Thickness of the trimmed skeleton is random, only how it spreads to the trimmed ends matters here.
+import sys
+import numpy as np
+from benchmarks.common import timed, load_central_line
+from src.skeleton_topology import NeighbourTable, trim_leaves, propagate_values
+from src.thickness import propagate_thickness_to_trims
+
+
+def loop_propagate_thickness_to_trims(trimmed_skeleton, skeleton, skeleton_thickness):
+    whole_skeleton_thicksness = np.zeros(skeleton.shape, dtype=np.int64)
+    whole_skeleton_thicksness[trimmed_skeleton > 0] = skeleton_thickness[trimmed_skeleton > 0]
+
+    queue = list([tuple(coords) for coords in np.argwhere(trimmed_skeleton)])
+    while(len(queue) > 0):
+        x, y, z = queue.pop(0)
+        thickness = whole_skeleton_thicksness[x, y, z]
+
+        for dx in [-1, 0, 1]:
+            for dy in [-1, 0, 1]:
+                for dz in [-1, 0, 1]:
+                    neighbour_x = x + dx
+                    neighbour_y = y + dy
+                    neighbour_z = z + dz
+                    if whole_skeleton_thicksness[neighbour_x, neighbour_y, neighbour_z] > 0:
+                        continue
+
+                    if not skeleton[neighbour_x, neighbour_y, neighbour_z]:
+                        continue
+
+                    whole_skeleton_thicksness[neighbour_x, neighbour_y, neighbour_z] = thickness
+                    queue.append((neighbour_x, neighbour_y, neighbour_z))
+
+    return whole_skeleton_thicksness
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'data/P32/central-line.npy'
+    slices = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    iters = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    try:
+        central_line = load_central_line(path)
+    except FileNotFoundError:
+        path = 'data/P32/dag.pkl'
+        central_line = load_central_line(path)
+    # the notebook loop reads neighbours without bounds checks, so the volume is padded
+    skeleton = np.pad(central_line[:slices], 1)
+    table = NeighbourTable.from_volume(skeleton)
+    trimmed = np.flatnonzero(trim_leaves(table, iters))
+    trimmed_radii = np.random.default_rng(0).integers(1, 30, len(trimmed)).astype(np.int32)
+    trimmed_skeleton = table.to_volume(trimmed)
+    skeleton_thickness = np.zeros(skeleton.shape, dtype=np.int32)
+    skeleton_thickness[tuple(table.coords[trimmed].T)] = trimmed_radii
+    print(f'{path}: volume {skeleton.shape}, {len(table)} skeleton voxels, {len(trimmed)} after trimming {iters} times')
+
+    expected, loop_time = timed(lambda: loop_propagate_thickness_to_trims(trimmed_skeleton, skeleton, skeleton_thickness))
+    result, dense_time = timed(lambda: propagate_thickness_to_trims(trimmed_skeleton, skeleton, skeleton_thickness))
+    (radii, _), sparse_time = timed(lambda: propagate_values(table, trimmed, trimmed_radii))
+    print(f'list queue                {loop_time:8.3f} s')
+    print(f'frontier, dense output    {dense_time:8.3f} s  ({loop_time / dense_time:6.0f}x)  equal: {np.array_equal(expected, result)}')
+    print(f'frontier, sparse only     {sparse_time:8.3f} s  ({loop_time / sparse_time:6.0f}x)  '
+          f'equal: {np.array_equal(expected[tuple(table.coords.T)], radii)}')
@@ -0,0 +1,84 @@
+# Compares the sparse neighbour table kernels with the per-voxel loops of the graph creation notebooks.
+# usage: python -m benchmarks.skeleton_topology [central line file | graph file] [trim iterations]
+# A graph file is drawn as a central line (node and edge voxels) when central-line.npy is not available.
+import sys
+import numpy as np
+from benchmarks.common import timed, compare, load_central_line
+from src.skeleton_topology import NeighbourTable, mark_leaves, mark_bifurcation_regions, trim_skeleton, \
+    leaves_mask, bifurcations_mask, trim_leaves
+
+
+def loop_trim_skeleton(skeleton):
+    new_skeleton = np.zeros(skeleton.shape)
+    for voxel in np.argwhere(skeleton):
+        x, y, z = tuple(voxel)
+        neighbours_count = 0
+        for dx in [-1, 0, 1]:
+            for dy in [-1, 0, 1]:
+                for dz in [-1, 0, 1]:
+                    if dx == dy == dz == 0:
+                        continue
+                    if skeleton[x + dx, y + dy, z + dz] > 0:
+                        neighbours_count += 1
+        if neighbours_count > 1:
+            new_skeleton[x, y, z] = 1
+    return new_skeleton.astype(np.uint8)
+
+
+def loop_mark_leaves(skeleton):
+    return skeleton - loop_trim_skeleton(skeleton)
+
+
+def loop_mark_bifurcation_regions(skeleton):
+    padded_skeleton = np.pad(skeleton, 1)
+    bifurcations_map = np.zeros(padded_skeleton.shape)
+    kernel = np.ones((3, 3, 3))
+    kernel[1, 1, 1] = 0
+    for x, y, z in np.argwhere(padded_skeleton > 0):
+        skeleton_slice = padded_skeleton[x-1:x+2, y-1:y+2, z-1:z+2]
+        bifurcations_map[x, y, z] = np.sum((skeleton_slice > 0) * kernel)
+    return (bifurcations_map[1:-1, 1:-1, 1:-1] > 2).astype(np.uint8)
+
+
+def loop_trim_skeleton_iterative(skeleton, iters):
+    def trim_skeleton_once(skeleton, candidate_voxels):
+        trimmed_skeleton = skeleton.copy()
+        leaves_neighbours = []
+        for voxel in candidate_voxels:
+            x, y, z = tuple(voxel)
+            voxel_neighbours = [(x + dx, y + dy, z + dz) for dx, dy, dz in
+                                [(dx, dy, dz) for dx in [-1, 0, 1] for dy in [-1, 0, 1] for dz in [-1, 0, 1]]
+                                if not dx == dy == dz == 0 and skeleton[x + dx, y + dy, z + dz]]
+            if len(voxel_neighbours) < 2:
+                trimmed_skeleton[x, y, z] = 0
+                leaves_neighbours += voxel_neighbours
+        return trimmed_skeleton.astype(np.uint8), leaves_neighbours
+
+    trimmed_skeleton, trim_neighbours = trim_skeleton_once(skeleton, np.argwhere(skeleton))
+    for _ in range(1, iters):
+        trimmed_skeleton, trim_neighbours = trim_skeleton_once(trimmed_skeleton, trim_neighbours)
+    return trimmed_skeleton
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'data/P32/central-line.npy'
+    iters = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    try:
+        central_line = load_central_line(path)
+    except FileNotFoundError:
+        path = 'data/P32/dag.pkl'
+        central_line = load_central_line(path)
+    print(f'{path}: volume {central_line.shape}, {np.count_nonzero(central_line)} central line voxels')
+
+    # dense wrappers include scanning the whole volume and writing the result back into one
+    compare('mark_leaves', lambda: loop_mark_leaves(central_line), lambda: mark_leaves(central_line))
+    compare('mark_bifurcation_regions', lambda: loop_mark_bifurcation_regions(central_line), lambda: mark_bifurcation_regions(central_line))
+    compare(f'trim_skeleton ({iters} iters)', lambda: loop_trim_skeleton_iterative(central_line, iters), lambda: trim_skeleton(central_line, iters))
+
+    # sparse kernels alone, as used by graph construction on an already built neighbour table
+    table, table_time = timed(lambda: NeighbourTable.from_volume(central_line))
+    print(f'neighbour table            {table_time:8.3f} s')
+    for name, kernel in [('leaves', lambda: leaves_mask(table)), ('bifurcations', lambda: bifurcations_mask(table)),
+                         (f'trim ({iters} iters)', lambda: trim_leaves(table, iters))]:
+        _, kernel_time = timed(kernel)
+        print(f'sparse {name:19s} {kernel_time:8.3f} s')
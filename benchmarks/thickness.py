@@ -0,0 +1,56 @@
+# Compares skeleton thickness from the distance transform and batched fill fractions with the per-voxel loop
+# of the final-2 notebook (run on a sample of skeleton voxels, its full time is extrapolated).
+# usage: python -m benchmarks.thickness [specimen dir] [slices] [sampled voxels]
+# Without reconstruction.npy and central-line.npy the specimen's dag.pkl is drawn as balls of its radii.
+import sys
+import numpy as np
+from skimage import morphology
+from benchmarks.common import timed, load_specimen
+from src.thickness import calculate_skeleton_thickness
+
+KERNEL_SIZES = range(70)
+FILL_THRESHOLD = 0.85
+
+
+def loop_skeleton_thickness(voxels, reconstruction, kernel_sizes, fill_threshold):
+    kernels = [(r, morphology.ball(r), np.sum(morphology.ball(r))) for r in sorted(kernel_sizes)]
+    max_kernel_radius = np.max(kernel_sizes)
+    padded_reconstruction = np.pad(reconstruction, max_kernel_radius)
+    result = np.zeros(len(voxels), dtype=int)
+    for i, voxel in enumerate(voxels):
+        x, y, z = tuple(voxel + max_kernel_radius)
+        for kernel_radius, kernel, kernel_sum in kernels:
+            reconstruction_slice = padded_reconstruction[
+                x - kernel_radius: x + kernel_radius + 1,
+                y - kernel_radius: y + kernel_radius + 1,
+                z - kernel_radius: z + kernel_radius + 1
+            ]
+            fill_factor = np.sum(np.logical_and(reconstruction_slice, kernel)) / kernel_sum
+            if fill_factor > fill_threshold:
+                result[i] = kernel_radius + 1
+            else:
+                break
+    return result
+
+
+if __name__ == '__main__':
+    directory = sys.argv[1] if len(sys.argv) > 1 else 'data/P32'
+    slices = int(sys.argv[2]) if len(sys.argv) > 2 else 120
+    samples = int(sys.argv[3]) if len(sys.argv) > 3 else 300
+
+    skeleton, reconstruction = load_specimen(directory, slices)
+    voxels = np.argwhere(skeleton)
+    print(f'{directory}: volume {skeleton.shape}, {len(voxels)} skeleton voxels, {np.count_nonzero(reconstruction)} reconstruction voxels')
+
+    sample = voxels[np.random.default_rng(0).choice(len(voxels), min(samples, len(voxels)), replace=False)]
+    expected, loop_time = timed(lambda: loop_skeleton_thickness(sample, reconstruction, KERNEL_SIZES, FILL_THRESHOLD))
+    loop_time *= len(voxels) / len(sample)
+
+    fill, fill_time = timed(lambda: calculate_skeleton_thickness(skeleton, reconstruction, KERNEL_SIZES, FILL_THRESHOLD))
+    distance, distance_time = timed(lambda: calculate_skeleton_thickness(skeleton, reconstruction, KERNEL_SIZES))
+
+    print(f'per-voxel loop (extrapolated) {loop_time:8.2f} s')
+    print(f'fill fraction                 {fill_time:8.2f} s  ({loop_time / fill_time:6.1f}x)  '
+          f'equal on sample: {np.array_equal(expected, fill[tuple(sample.T)])}')
+    print(f'distance transform            {distance_time:8.2f} s  ({loop_time / distance_time:6.1f}x)  '
+          f'mean |difference| to fill fraction: {np.mean(np.abs(distance - fill)[skeleton]):.3f}')
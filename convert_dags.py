@@ -0,0 +1,20 @@
+import glob, os
+import numpy as np
+from src.dag_storage import convert_legacy_dag
+from src.volume_io import save_packed_volume
+
+if __name__ == "__main__":
+    pickle_files = sorted(glob.glob(os.path.join('data', 'P*', '*.pkl')))
+    print(f"Converting graph files: {pickle_files}")
+
+    for pickle_path in pickle_files:
+        output_path = convert_legacy_dag(pickle_path)
+        print(f"{pickle_path} -> {output_path}")
+
+    reconstruction_files = sorted(glob.glob(os.path.join('data', 'P*', 'reconstruction.npy')))
+    print(f"Packing reconstructions: {reconstruction_files}")
+
+    for reconstruction_path in reconstruction_files:
+        output_path = reconstruction_path.replace('.npy', '.bits')
+        save_packed_volume(output_path, np.load(reconstruction_path, mmap_mode='r'))
+        print(f"{reconstruction_path} -> {output_path}")
@@ -1,16 +1,22 @@
-import re, os
+import re, os, sys
 from src.graph_parameters import GraphParameters
 from src.graph_stats import GraphStats
 from src.dag_generational_comparison import DAG_GenerationalComparison
 from src.dag import DAG
 from src.node import Node
 from src.edge import Edge
-from src.utils import load_dag
+from src.dag_storage import load_dag
+from src.batch_parameters import compare_specimens
 
 if __name__ == "__main__":
-    pkl_stats_re = re.compile('.*P[0-9]*\\\\dag_with_stats.pkl')
+    # python main.py P04 P06 ... - calculate parameters of given specimens in parallel and compare them
+    if len(sys.argv) > 1:
+        compare_specimens(sys.argv[1:], 8)
+        sys.exit()
+
+    stats_re = re.compile('.*P[0-9]*\\\\dag_with_stats.npz')
     data_files = [os.path.join(path, name) for path, _, files in os.walk('.\\data') for name in files]
-    graph_files = list(filter(pkl_stats_re.match, data_files)) 
+    graph_files = list(filter(stats_re.match, data_files)) 
     print(f"Currently avalible graph with stats files: {graph_files}")
 
     dags = []
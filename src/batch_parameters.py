@@ -0,0 +1,79 @@
+import os
+import numbers
+import contextlib
+from multiprocessing import Pool
+import pandas as pd
+from src.graph_parameters import GraphParameters, render_figures
+
+GRAPH_FILES = ('dag.npz', 'dag.pkl')
+RECONSTRUCTION_FILES = ('reconstruction.bits', 'reconstruction.npy')
+
+
+def find_specimen_file(specimen_dir, names):
+    for name in names:
+        path = os.path.join(specimen_dir, name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def calculate_specimen_parameters(task):
+    specimen_id, data_dir, with_reconstruction, verbose, parameters_kwargs = task
+    specimen_dir = os.path.join(data_dir, specimen_id)
+    graph_path = find_specimen_file(specimen_dir, GRAPH_FILES)
+    if graph_path is None:
+        return specimen_id, None, [], f'no graph file in {specimen_dir}'
+    reconstruction_path = find_specimen_file(specimen_dir, RECONSTRUCTION_FILES) if with_reconstruction else None
+
+    try:
+        with contextlib.ExitStack() as stack:
+            if not verbose:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+            # reconstructions are memory mapped, so a worker only holds a few slabs of the volume at once
+            # workers never draw, figures are queued and sent back to the parent with the graph
+            parameters = GraphParameters(graph_path, reconstruction_path, dag_id=specimen_id, mmap_mode='r',
+                                         **dict(parameters_kwargs, render=False))
+    except Exception as ex:
+        return specimen_id, None, [], str(ex)
+    return specimen_id, parameters.dag, parameters.renders, None
+
+
+def calculate_parameters(specimen_ids, data_dir='data', processes=None, with_reconstruction=True, verbose=False, render=False,
+                         **parameters_kwargs):
+    # every specimen runs in a fresh worker process (maxtasksperchild=1), so memory is returned after each graph;
+    # with render figures queued by the workers are drawn here
+    tasks = [(specimen_id, data_dir, with_reconstruction, verbose, parameters_kwargs) for specimen_id in specimen_ids]
+    processes = min(processes or os.cpu_count(), max(len(tasks), 1))
+
+    results = []
+    with Pool(processes, maxtasksperchild=1) as pool:
+        for specimen_id, dag, renders, error in pool.imap(calculate_specimen_parameters, tasks, chunksize=1):
+            if error is not None:
+                print(f"Could not calculate parameters of {specimen_id} - {error}")
+                continue
+            print(f"Calculated parameters of {specimen_id}")
+            if render:
+                render_figures(renders)
+            results.append((dag, specimen_id))
+    return results
+
+
+def parameters_table(results):
+    rows = {}
+    for dag, specimen_id in results:
+        # numeric parameters only - dicts like the projection would have ndim 0 as well
+        rows[specimen_id] = {k: v for k, v in dag.data.items() if isinstance(v, numbers.Number)}
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+def compare_specimens(specimen_ids, max_gen=8, data_dir='data', processes=None, render=False, **parameters_kwargs):
+    # plotting is imported only here, workers calculating parameters do not need matplotlib
+    from src.dag_generational_comparison import DAG_GenerationalComparison
+    results = calculate_parameters(specimen_ids, data_dir, processes, render=render, max_gen=max_gen, save=False,
+                                   **parameters_kwargs)
+    table = parameters_table(results)
+    table.to_csv('results/batch_parameters.csv')
+
+    dag_gen_comparison = DAG_GenerationalComparison([r[0] for r in results], [r[1] for r in results], max_gen)
+    dag_gen_comparison.compare_all()
+    return results, table
@@ -0,0 +1,456 @@
+import numpy as np
+from src.node import Node
+from src.edge import Edge
+from src import traversal
+
+# per-voxel attributes, stored aligned with the voxel buffers instead of per node/edge
+VOXEL_ATTRIBUTES = ('radii_list', 'voxels2d')
+
+
+class CompactDAG:
+    def __init__(self,
+            node_coords,
+            edge_node_a,
+            edge_node_b,
+            volume_shape,
+            root_index = 0,
+            node_voxels = None,
+            node_voxel_offsets = None,
+            edge_voxels = None,
+            edge_voxel_offsets = None):
+        self.node_coords = np.asarray(node_coords, dtype=np.int32).reshape(-1, 3)
+        self.edge_node_a = np.asarray(edge_node_a, dtype=np.int32)
+        self.edge_node_b = np.asarray(edge_node_b, dtype=np.int32)
+        self.volume_shape = tuple(int(s) for s in volume_shape)
+        self.root_index = int(root_index)
+
+        self.voxel_buffers = {}
+        self.node_voxels, self.node_voxel_offsets = _voxel_buffer(node_voxels, node_voxel_offsets, self.number_of_nodes)
+        self.edge_voxels, self.edge_voxel_offsets = _voxel_buffer(edge_voxels, edge_voxel_offsets, self.number_of_edges)
+
+        self.node_columns = {}
+        self.edge_columns = {}
+        self.node_voxel_columns = {}
+        self.edge_voxel_columns = {}
+        # which entries of a column were set, for columns set one entry at a time - fully set columns have no mask
+        self.node_present = {}
+        self.edge_present = {}
+        self.data = {}
+        self.build_children_index()
+
+    def build_children_index(self):
+        # CSR layout: children edges of node n are child_edges[child_offsets[n]:child_offsets[n+1]]
+        self.child_edges = np.argsort(self.edge_node_a, kind='stable').astype(np.int32)
+        counts = np.bincount(self.edge_node_a, minlength=self.number_of_nodes)
+        self.child_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self._orderings = {}
+
+    def _cached_ordering(self, name, function):
+        if name not in self._orderings:
+            self._orderings[name] = function(self)
+        return self._orderings[name]
+
+    def edge_preorder(self):
+        return self._cached_ordering('edge_preorder', traversal.edge_preorder)
+
+    def edge_postorder(self):
+        return self._cached_ordering('edge_postorder', traversal.edge_postorder)
+
+    def node_preorder(self):
+        return self._cached_ordering('node_preorder', traversal.node_preorder)
+
+    def edge_levels(self):
+        return self._cached_ordering('edge_levels', traversal.edge_levels)
+
+    def parent_edges(self):
+        return self._cached_ordering('parent_edges', traversal.parent_edges)
+
+    def subtree_sizes(self):
+        return self._cached_ordering('subtree_sizes', traversal.subtree_sizes)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_orderings'] = {}
+        return state
+
+    @property
+    def node_voxels(self):
+        return self.voxel_buffers['node_voxels']
+
+    @node_voxels.setter
+    def node_voxels(self, voxels):
+        self.voxel_buffers['node_voxels'] = voxels
+
+    @property
+    def edge_voxels(self):
+        return self.voxel_buffers['edge_voxels']
+
+    @edge_voxels.setter
+    def edge_voxels(self, voxels):
+        self.voxel_buffers['edge_voxels'] = voxels
+
+    @property
+    def number_of_nodes(self):
+        return len(self.node_coords)
+
+    @property
+    def number_of_edges(self):
+        return len(self.edge_node_a)
+
+    @property
+    def root(self):
+        return NodeView(self, self.root_index)
+
+    @property
+    def nodes(self):
+        return _ViewSequence(self, NodeView, self.number_of_nodes)
+
+    @property
+    def edges(self):
+        return _ViewSequence(self, EdgeView, self.number_of_edges)
+
+    def children_edges(self, node_index):
+        return self.child_edges[self.child_offsets[node_index]:self.child_offsets[node_index + 1]]
+
+    def children_count(self):
+        return np.diff(self.child_offsets)
+
+    def node_voxels_of(self, node_index):
+        return self.node_voxels[self.node_voxel_offsets[node_index]:self.node_voxel_offsets[node_index + 1]]
+
+    def edge_voxels_of(self, edge_index):
+        return self.edge_voxels[self.edge_voxel_offsets[edge_index]:self.edge_voxel_offsets[edge_index + 1]]
+
+    def node_voxel_counts(self):
+        return np.diff(self.node_voxel_offsets)
+
+    def edge_voxel_counts(self):
+        return np.diff(self.edge_voxel_offsets)
+
+    def set_node_column(self, key, values):
+        self.node_columns[key] = _checked_column(values, self.number_of_nodes, key)
+        self.node_present.pop(key, None)
+
+    def set_edge_column(self, key, values):
+        self.edge_columns[key] = _checked_column(values, self.number_of_edges, key)
+        self.edge_present.pop(key, None)
+
+    def set_node_voxel_column(self, key, values):
+        self.node_voxel_columns[key] = _checked_column(values, self.node_voxel_offsets[-1], key)
+        self.node_present.pop(key, None)
+
+    def set_edge_voxel_column(self, key, values):
+        self.edge_voxel_columns[key] = _checked_column(values, self.edge_voxel_offsets[-1], key)
+        self.edge_present.pop(key, None)
+
+    def __setitem__(self, key, value):
+        self.data[key] = value
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    @staticmethod
+    def from_dag(dag):
+        nodes = list(dag.nodes)
+        edges = list(dag.edges)
+        node_ids = {id(n): i for i, n in enumerate(nodes)}
+        edge_ids = {id(e): i for i, e in enumerate(edges)}
+
+        compact = CompactDAG(
+            node_coords=[n.coords for n in nodes],
+            edge_node_a=[node_ids[id(e.node_a)] for e in edges],
+            edge_node_b=[node_ids[id(e.node_b)] for e in edges],
+            volume_shape=dag.volume_shape,
+            root_index=node_ids[id(dag.root)],
+            node_voxels=[np.asarray(n.data.get('voxels', np.empty((0, 3))), dtype=np.int32).reshape(-1, 3) for n in nodes],
+            edge_voxels=[np.asarray(e.data.get('voxels', np.empty((0, 3))), dtype=np.int32).reshape(-1, 3) for e in edges])
+
+        def convert(value):
+            if isinstance(value, Node):
+                return NodeView(compact, node_ids[id(value)])
+            if isinstance(value, Edge):
+                return EdgeView(compact, edge_ids[id(value)])
+            return value
+
+        for objects, columns, voxel_columns, voxel_offsets, present in (
+                (nodes, compact.node_columns, compact.node_voxel_columns, compact.node_voxel_offsets, compact.node_present),
+                (edges, compact.edge_columns, compact.edge_voxel_columns, compact.edge_voxel_offsets, compact.edge_present)):
+            keys = {k for o in objects for k in o.data if k != 'voxels'}
+            for key in sorted(keys):
+                if key in VOXEL_ATTRIBUTES:
+                    # per voxel values can not be None, objects holding None are stored as not set
+                    mask = np.array([o.data.get(key) is not None for o in objects], dtype=bool)
+                    if not mask.any():
+                        continue
+                    voxel_columns[key] = _voxel_column_from_values(
+                        [o.data[key] for o in objects if o.data.get(key) is not None], voxel_offsets, mask, key)
+                else:
+                    mask = np.array([key in o.data for o in objects], dtype=bool)
+                    column = _column_from_values([convert(o.data[key]) for o in objects if key in o.data])
+                    columns[key] = _spread_column(column, mask)
+                if not mask.all():
+                    present[key] = mask
+
+        compact.data = dict(dag.data)
+        return compact
+
+    def to_dag(self):
+        from src.dag import DAG
+        nodes = [Node(view.coords) for view in self.nodes]
+        for n, view in zip(nodes, self.nodes):
+            n.data = view.data
+        for e in range(self.number_of_edges):
+            edge = Edge(nodes[self.edge_node_a[e]], nodes[self.edge_node_b[e]])
+            edge.data = EdgeView(self, e).data
+            nodes[self.edge_node_a[e]].add_edge(edge)
+
+        def convert(data):
+            for key, value in data.items():
+                if isinstance(value, NodeView):
+                    data[key] = nodes[value.index]
+        for n in nodes:
+            convert(n.data)
+
+        dag = DAG(nodes[self.root_index], self.volume_shape)
+        dag.data = dict(self.data)
+        return dag
+
+
+class NodeView:
+    __slots__ = ('dag', 'index')
+
+    def __init__(self, dag, index):
+        self.dag = dag
+        self.index = int(index)
+
+    @property
+    def coords(self):
+        return tuple(int(c) for c in self.dag.node_coords[self.index])
+
+    @property
+    def edges(self):
+        return [EdgeView(self.dag, e) for e in self.dag.children_edges(self.index)]
+
+    @property
+    def data(self):
+        return _view_data(self, self.dag.node_columns, self.dag.node_voxel_columns, self.dag.node_present)
+
+    def get_neighbours(self):
+        return [e.node_b for e in self.edges]
+
+    def __getitem__(self, key):
+        dag = self.dag
+        voxels_slice = slice(dag.node_voxel_offsets[self.index], dag.node_voxel_offsets[self.index + 1])
+        return _get_value(key, self.index, voxels_slice, dag.voxel_buffers, 'node_voxels', dag.node_columns, dag.node_voxel_columns,
+                          dag.node_present)
+
+    def __setitem__(self, key, value):
+        dag = self.dag
+        voxels_slice = slice(dag.node_voxel_offsets[self.index], dag.node_voxel_offsets[self.index + 1])
+        _set_value(key, value, self.index, voxels_slice, dag.number_of_nodes,
+                   dag.voxel_buffers, 'node_voxels', dag.node_columns, dag.node_voxel_columns, dag.node_present)
+
+    def __eq__(self, other):
+        return isinstance(other, NodeView) and other.dag is self.dag and other.index == self.index
+
+    def __hash__(self):
+        return hash(self.coords)
+
+    def __reduce__(self):
+        return (NodeView, (self.dag, self.index))
+
+    def __repr__(self):
+        return f'Node {str(self.coords)}'
+
+
+class EdgeView:
+    __slots__ = ('dag', 'index')
+
+    def __init__(self, dag, index):
+        self.dag = dag
+        self.index = int(index)
+
+    @property
+    def node_a(self):
+        return NodeView(self.dag, self.dag.edge_node_a[self.index])
+
+    @property
+    def node_b(self):
+        return NodeView(self.dag, self.dag.edge_node_b[self.index])
+
+    @property
+    def data(self):
+        return _view_data(self, self.dag.edge_columns, self.dag.edge_voxel_columns, self.dag.edge_present)
+
+    def __getitem__(self, key):
+        dag = self.dag
+        voxels_slice = slice(dag.edge_voxel_offsets[self.index], dag.edge_voxel_offsets[self.index + 1])
+        return _get_value(key, self.index, voxels_slice, dag.voxel_buffers, 'edge_voxels', dag.edge_columns, dag.edge_voxel_columns,
+                          dag.edge_present)
+
+    def __setitem__(self, key, value):
+        dag = self.dag
+        voxels_slice = slice(dag.edge_voxel_offsets[self.index], dag.edge_voxel_offsets[self.index + 1])
+        _set_value(key, value, self.index, voxels_slice, dag.number_of_edges,
+                   dag.voxel_buffers, 'edge_voxels', dag.edge_columns, dag.edge_voxel_columns, dag.edge_present)
+
+    def __eq__(self, other):
+        return isinstance(other, EdgeView) and other.dag is self.dag and other.index == self.index
+
+    def __hash__(self):
+        return hash((self.dag.edge_node_a[self.index], self.dag.edge_node_b[self.index]))
+
+    def __reduce__(self):
+        return (EdgeView, (self.dag, self.index))
+
+    def __repr__(self):
+        return f'Edge {self.node_a.coords} -> {self.node_b.coords}'
+
+
+class _ViewSequence:
+    def __init__(self, dag, view_class, size):
+        self.dag = dag
+        self.view_class = view_class
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.view_class(self.dag, i) for i in range(*index.indices(self.size))]
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        return self.view_class(self.dag, index)
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self.view_class(self.dag, i)
+
+
+def _voxel_buffer(voxels, offsets, count):
+    if voxels is None:
+        return np.empty((0, 3), dtype=np.int32), np.zeros(count + 1, dtype=np.int64)
+    if offsets is None:
+        # list of per-entity voxel arrays
+        lengths = [len(v) for v in voxels]
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        voxels = np.concatenate(voxels) if len(voxels) > 0 else np.empty((0, 3))
+    voxels = np.asarray(voxels, dtype=np.int32).reshape(-1, 3)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if len(offsets) != count + 1 or offsets[-1] != len(voxels):
+        raise ValueError(f'Voxel offsets do not match - {len(offsets)} offsets for {count} entries')
+    return voxels, offsets
+
+
+def _checked_column(values, size, key):
+    values = np.asarray(values)
+    if len(values) != size:
+        raise ValueError(f'Column {key} has {len(values)} values, expected {size}')
+    return values
+
+
+def _object_column(values):
+    column = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        column[i] = v
+    return column
+
+
+def _column_from_values(values):
+    if any(v is None or isinstance(v, (NodeView, EdgeView)) for v in values):
+        return _object_column(values)
+    try:
+        column = np.asarray(values)
+    except ValueError:
+        return _object_column(values)
+    if column.dtype.kind not in 'biuf':
+        return _object_column(values)
+    return column
+
+
+def _empty_column(size, dtype, shape=()):
+    # unset entries are NaN in float columns and 0 in integer / bool columns
+    if dtype.kind == 'f':
+        return np.full((size,) + tuple(shape), np.nan, dtype=dtype)
+    if dtype.kind in 'biu':
+        return np.zeros((size,) + tuple(shape), dtype=dtype)
+    return np.empty(size, dtype=object)
+
+
+def _new_column(size, value):
+    if value is None or isinstance(value, (NodeView, EdgeView)):
+        return np.empty(size, dtype=object)
+    value = np.asarray(value)
+    return _empty_column(size, value.dtype, value.shape)
+
+
+def _spread_column(column, mask):
+    # column of the entries selected by mask, spread over all entries
+    if mask.all():
+        return column
+    spread = _empty_column(len(mask), column.dtype, column.shape[1:])
+    spread[mask] = column
+    return spread
+
+
+def _voxel_column_from_values(values, voxel_offsets, mask, key):
+    values = [np.asarray(v) for v in values]
+    column = _empty_column(voxel_offsets[-1], np.result_type(*values), values[0].shape[1:])
+    for i, value in zip(np.flatnonzero(mask), values):
+        start, stop = voxel_offsets[i], voxel_offsets[i + 1]
+        if len(value) != stop - start:
+            raise ValueError(f'Column {key} has {len(value)} values for an entry with {stop - start} voxels')
+        column[start:stop] = value
+    return column
+
+
+def _get_value(key, index, voxels_slice, buffers, buffer_name, columns, voxel_columns, present):
+    if key == 'voxels':
+        return buffers[buffer_name][voxels_slice]
+    if key in present and not present[key][index]:
+        raise KeyError(key)
+    if key in voxel_columns:
+        return voxel_columns[key][voxels_slice]
+    if key in columns:
+        return columns[key][index]
+    raise KeyError(key)
+
+
+def _set_value(key, value, index, voxels_slice, size, buffers, buffer_name, columns, voxel_columns, present):
+    if key == 'voxels' or key in VOXEL_ATTRIBUTES:
+        buffer = buffers[buffer_name] if key == 'voxels' else voxel_columns.get(key)
+        value = np.asarray(value)
+        if buffer is None or len(value) != voxels_slice.stop - voxels_slice.start:
+            raise ValueError(f'Cannot change the number of voxels of {key} in a compact graph')
+        buffer[voxels_slice] = value
+        if key in present:
+            present[key][index] = True
+        return
+
+    column = columns.get(key)
+    if column is None:
+        column = columns[key] = _new_column(size, value)
+        present[key] = np.zeros(size, dtype=bool)
+    elif column.dtype != object:
+        if value is None or isinstance(value, (NodeView, EdgeView)):
+            column = columns[key] = _object_column(list(column))
+        else:
+            array_value = np.asarray(value)
+            if array_value.dtype.kind not in 'biuf' or array_value.shape != column.shape[1:]:
+                column = columns[key] = _object_column(list(column))
+            elif not np.can_cast(array_value.dtype, column.dtype, casting='same_kind'):
+                column = columns[key] = column.astype(np.result_type(column.dtype, array_value.dtype))
+    column[index] = value
+    if key in present:
+        present[key][index] = True
+
+
+def _view_data(view, columns, voxel_columns, present):
+    data = {'voxels': view['voxels']}
+    for key in list(columns) + list(voxel_columns):
+        if key not in present or present[key][view.index]:
+            data[key] = view[key]
+    return data
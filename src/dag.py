@@ -1,4 +1,3 @@
-import pickle
 from src.utils import get_edges_with_dfs, get_nodes_with_dfs
 
 class DAG:
@@ -14,14 +13,3 @@ class DAG:
     
     def __getitem__(self, key):
         return self.data[key]
-           
-
-def save_dag(dag, filename):
-    with open(filename, 'wb') as output:
-        pickle.dump(dag, output)
-        
-
-def load_dag(filename):
-    with open(filename, 'rb') as input_:
-        dag = pickle.load(input_)
-        return dag
\ No newline at end of file
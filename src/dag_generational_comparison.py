@@ -68,6 +68,7 @@ class DAG_GenerationalComparison:
             'vessel_total_length',
             'vessel_avg_length',
             'vascular_structure_volume',
+            'mean_interstitial_distance',
             'vascular_network_projection_area',
             'projection_explant_area',
             'vascular_density',
@@ -80,6 +81,7 @@ class DAG_GenerationalComparison:
             d['vessel_total_length'],
             d['vessel_avg_length'],
             d['vascular_structure_volume'],
+            d['mean_interstitial_distance'],
             d['vascular_network_projection_area'],
             d['projection_explant_area'],
             d['vascular_density'],
@@ -157,7 +159,7 @@ class DAG_GenerationalComparison:
         for i, d in enumerate(self.dags):
             interstitial_distances_generations = [(edge['interstitial_distance'], edge['generation']) for edge in d.edges]
             for e in interstitial_distances_generations:
-                if (e[1]-1 < self.max_gen):
+                if (e[1]-1 < self.max_gen) and not np.isnan(e[0]):
                     interstitial_distances_per_gen_per_graph[e[1]-1][i].append(e[0])
 
         self.__get_boxplot_comparison(interstitial_distances_per_gen_per_graph, "interstitial_distances_angles_per_generation", True)
@@ -170,6 +172,7 @@ class DAG_GenerationalComparison:
             'total vessel len', 
             'vessel avg len', 
             'vascular structure vol', 
+            'mean interstitial distance',
             'vascular network proj area',
             'projection explant area',
             'vascular density',
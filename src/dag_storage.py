@@ -0,0 +1,231 @@
+import os
+import pickle
+from collections.abc import MutableMapping
+import numpy as np
+from src.compact_dag import CompactDAG, NodeView, EdgeView
+from src.dag import DAG
+from src.node import Node
+from src.edge import Edge
+
+FORMAT_NAME = 'compact_dag'
+FORMAT_VERSION = 1
+
+STRUCTURE_ARRAYS = (
+    'volume_shape',
+    'root_index',
+    'node_coords',
+    'edge_node_a',
+    'edge_node_b',
+    'node_voxel_offsets',
+    'edge_voxel_offsets',
+)
+COLUMN_GROUPS = ('node_columns', 'edge_columns', 'node_voxel_columns', 'edge_voxel_columns')
+REFERENCE_GROUPS = {'node_references': NodeView, 'edge_references': EdgeView}
+PRESENCE_GROUPS = ('node_present', 'edge_present')
+
+
+####################################################################################
+#                                      SAVING                                      #
+####################################################################################
+
+def save_dag(dag, filename):
+    if not isinstance(dag, CompactDAG):
+        dag = CompactDAG.from_dag(dag)
+
+    arrays = {
+        'format_name': np.array(FORMAT_NAME),
+        'format_version': np.array(FORMAT_VERSION),
+        'volume_shape': np.array(dag.volume_shape, dtype=np.int64),
+        'root_index': np.array(dag.root_index, dtype=np.int64),
+        'node_coords': dag.node_coords,
+        'edge_node_a': dag.edge_node_a,
+        'edge_node_b': dag.edge_node_b,
+        'node_voxel_offsets': dag.node_voxel_offsets,
+        'edge_voxel_offsets': dag.edge_voxel_offsets,
+        'voxels/node_voxels': dag.node_voxels,
+        'voxels/edge_voxels': dag.edge_voxels,
+    }
+
+    for group in COLUMN_GROUPS:
+        for key, column in getattr(dag, group).items():
+            if column.dtype != object:
+                arrays[f'{group}/{key}'] = column
+                continue
+            # object columns are only storable when they reference nodes / edges of the graph
+            prefix = 'node' if group == 'node_columns' else 'edge'
+            arrays[f'{_references_group(column, key)}/{prefix}/{key}'] = np.array(
+                [-1 if v is None else v.index for v in column], dtype=np.int64)
+
+    for group in PRESENCE_GROUPS:
+        for key, mask in getattr(dag, group).items():
+            arrays[f'{group}/{key}'] = mask
+
+    for key, value in _flatten(dag.data).items():
+        arrays[f'data/{key}'] = value
+
+    with open(filename, 'wb') as output:
+        np.savez(output, **arrays)
+
+
+def _references_group(column, key):
+    kinds = {type(v) for v in column if v is not None}
+    if len(kinds) <= 1 and kinds <= {NodeView, EdgeView}:
+        return 'node_references' if NodeView in kinds else 'edge_references'
+    raise ValueError(f'Column {key} holds values that can not be stored in the graph file')
+
+
+def _flatten(data, prefix=''):
+    flat = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f'{prefix}{key}/'))
+            continue
+        value = np.asarray(value)
+        if value.dtype == object:
+            raise ValueError(f'DAG data {prefix}{key} can not be stored in the graph file')
+        flat[f'{prefix}{key}'] = value
+    return flat
+
+
+####################################################################################
+#                                      LOADING                                     #
+####################################################################################
+
+def load_dag(filename, lazy=True):
+    with open(filename, 'rb') as input_:
+        magic = input_.read(2)
+    if magic != b'PK':
+        return load_legacy_dag(filename)
+    return load_compact_dag(filename, lazy)
+
+
+def load_compact_dag(filename, lazy=True):
+    with np.load(filename) as archive:
+        names = list(archive.files)
+        if str(archive['format_name']) != FORMAT_NAME:
+            raise ValueError(f'{filename} is not a graph file')
+        version = int(archive['format_version'])
+        if version > FORMAT_VERSION:
+            raise ValueError(f'{filename} has graph format version {version}, newest supported is {FORMAT_VERSION}')
+        structure = {name: archive[name] for name in STRUCTURE_ARRAYS}
+
+    dag = CompactDAG(
+        node_coords=structure['node_coords'],
+        edge_node_a=structure['edge_node_a'],
+        edge_node_b=structure['edge_node_b'],
+        volume_shape=structure['volume_shape'],
+        root_index=structure['root_index'])
+    dag.node_voxel_offsets = structure['node_voxel_offsets']
+    dag.edge_voxel_offsets = structure['edge_voxel_offsets']
+
+    dag.voxel_buffers = LazyArchiveArrays(filename, 'voxels/', names)
+    for group in COLUMN_GROUPS:
+        setattr(dag, group, LazyArchiveArrays(filename, f'{group}/', names))
+
+    # references are cheap and needed as views, so they are always loaded eagerly
+    for group, view_class in REFERENCE_GROUPS.items():
+        references = LazyArchiveArrays(filename, f'{group}/', names)
+        references.load_all()
+        for name in list(references):
+            prefix, key = name.split('/', 1)
+            columns = dag.node_columns if prefix == 'node' else dag.edge_columns
+            columns[key] = np.array([None if i < 0 else view_class(dag, i) for i in references[name]], dtype=object)
+
+    # masks of columns set only for some nodes / edges, older files have none
+    for group in PRESENCE_GROUPS:
+        masks = LazyArchiveArrays(filename, f'{group}/', names)
+        masks.load_all()
+        setattr(dag, group, {key: masks[key] for key in masks})
+
+    data = LazyArchiveArrays(filename, 'data/', names)
+    data.load_all()
+    dag.data = _unflatten(data)
+
+    if not lazy:
+        for mapping in [dag.voxel_buffers] + [getattr(dag, group) for group in COLUMN_GROUPS]:
+            mapping.load_all()
+    return dag
+
+
+def _unflatten(flat):
+    data = {}
+    for key in flat:
+        value = flat[key]
+        value = value.item() if value.ndim == 0 else value
+        *path, name = key.split('/')
+        target = data
+        for part in path:
+            target = target.setdefault(part, {})
+        target[name] = value
+    return data
+
+
+class LazyArchiveArrays(MutableMapping):
+    # arrays of one group of a graph file, read from disk only when first accessed;
+    # the file is opened for each read only, so no handles are left open between reads
+    def __init__(self, filename, prefix, names):
+        self.filename = filename
+        self.prefix = prefix
+        self.pending = {n[len(prefix):] for n in names if n.startswith(prefix)}
+        self.loaded = {}
+
+    def _read(self, keys):
+        with np.load(self.filename) as archive:
+            for key in keys:
+                self.loaded[key] = archive[self.prefix + key]
+                self.pending.discard(key)
+
+    def load_all(self):
+        if len(self.pending) > 0:
+            self._read(list(self.pending))
+
+    def __getitem__(self, key):
+        if key in self.pending:
+            self._read([key])
+        return self.loaded[key]
+
+    def __setitem__(self, key, value):
+        self.pending.discard(key)
+        self.loaded[key] = value
+
+    def __delitem__(self, key):
+        if key in self.pending:
+            self.pending.discard(key)
+        else:
+            del self.loaded[key]
+
+    def __contains__(self, key):
+        return key in self.loaded or key in self.pending
+
+    def __iter__(self):
+        return iter(list(self.loaded) + sorted(self.pending))
+
+    def __len__(self):
+        return len(self.loaded) + len(self.pending)
+
+
+####################################################################################
+#                                  LEGACY PICKLES                                  #
+####################################################################################
+
+class _LegacyUnpickler(pickle.Unpickler):
+    # old graph files were pickled from notebooks, so classes are bound to __main__
+    classes = {'DAG': DAG, 'Node': Node, 'Edge': Edge}
+
+    def find_class(self, module, name):
+        if module == '__main__' and name in self.classes:
+            return self.classes[name]
+        return super().find_class(module, name)
+
+
+def load_legacy_dag(filename):
+    with open(filename, 'rb') as input_:
+        dag = _LegacyUnpickler(input_).load()
+    return dag if isinstance(dag, CompactDAG) else CompactDAG.from_dag(dag)
+
+
+def convert_legacy_dag(pickle_path, output_path=None):
+    if output_path is None:
+        output_path = os.path.splitext(pickle_path)[0] + '.npz'
+    save_dag(load_legacy_dag(pickle_path), output_path)
+    return output_path
@@ -1,9 +1,19 @@
+from functools import lru_cache
 import numpy as np
 from vis_utils import VolumeVisualizer, ColorMapVisualizer
 import matplotlib.pyplot as plt
 from PIL import Image
 from skimage.morphology import skeletonize_3d
-from scipy.ndimage import zoom
+from src.compact_dag import CompactDAG
+
+# number of voxel writes gathered into one scatter when stamping kernels
+STAMP_CHUNK_SIZE = 2 ** 18
+# balls with kernels of at least that many voxels are drawn into the block around every centre instead of scattered
+BLOCK_KERNEL_SIZE = 2 ** 10
+# largest step (in voxels along every axis) between tube centres for which only the added part of a ball is drawn
+TUBE_STEP_REACH = 3
+TUBE_STEPS = (2 * TUBE_STEP_REACH + 1,) * 3
+
 
 class DAG_Visualizer:
     @staticmethod
@@ -49,39 +59,308 @@ class DAG_Visualizer:
 
     @staticmethod
     def vascular_network_area(reconstruction_projection_mask, dag_id):
-        plt.figure(figsize=(15, 10))
-        plt.title('vascular network area 2d')
         im = Image.fromarray(reconstruction_projection_mask.T)
         im.save(f"results/{dag_id}_vascular_network_2d.png")
 
     @staticmethod
     def vascular_density(convex_projection, dag_id):
-        plt.figure(figsize=(15, 10))
-        plt.title('convex projection')
         im = Image.fromarray(convex_projection.T)
         im.save(f"results/{dag_id}_convex_projection.png")
 
     @staticmethod
-    def visualize_contours(scales, contours_lengths, rec_mask, proj_contour_func, dag_id):
-        plt.figure(figsize=(10, 40))
-        for i, scale in enumerate(scales):
-            proj = zoom(rec_mask, scale, order=0)
-            contour = proj_contour_func()
-            plt.subplot(len(scales), 2, 2 * i + 1)
-            plt.imshow(proj.T)
-            plt.subplot(len(scales), 2, 2 * i + 2)
-            plt.imshow(contour.T)
-            contours_lengths.append(int(np.sum(contour)))
-        plt.savefig(f'results/{dag_id}_contours_scaled')
-        plt.clf()
-        return scales, contours_lengths
+    def box_counting(contour, box_sizes, counts, dimension, intercept, dag_id):
+        plt.figure(figsize=(15, 10))
+        plt.title('projection contour')
+        plt.imshow(contour.T)
+        plt.savefig(f'results/{dag_id}_projection_contour')
+        plt.close()
 
-    @staticmethod
-    def scales_contour_lengths(scales, contours_lengths, lm, dag_id):
+        occupied = counts > 0
+        log_inverse_sizes = np.log(1 / box_sizes[occupied])
         plt.figure(figsize=(11, 7))
-        plt.scatter(np.log(scales), np.log(contours_lengths), s=30)
-        plt.plot(np.log(scales), lm.predict(np.log(scales).reshape(-1, 1)), color='red')
-        plt.xlabel('log(scaling_factor)')
-        plt.ylabel('log(contour_area)')
-        plt.savefig(f'results/{dag_id}_scales_contour_corelation')
-        plt.clf()
\ No newline at end of file
+        plt.scatter(log_inverse_sizes, np.log(counts[occupied]), s=30)
+        plt.plot(log_inverse_sizes, log_inverse_sizes * dimension + intercept, color='red')
+        plt.xlabel('log(1 / box_size)')
+        plt.ylabel('log(boxes_count)')
+        plt.savefig(f'results/{dag_id}_box_counting')
+        plt.close()
+
+    ##################################################################################
+    #                          LABEL VOLUMES FOR QC OVERLAYS                         #
+    ##################################################################################
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def _squared_norms_grid(radius):
+        # squared distances from the centre of a (2 * radius + 1) ** 3 block, flattened, as small as they fit;
+        # tubes are drawn a radius at a time, so only the last block is kept
+        axis = np.arange(-radius, radius + 1) ** 2
+        norms = axis[:, np.newaxis, np.newaxis] + axis[:, np.newaxis] + axis
+        return norms.ravel().astype(np.min_scalar_type(3 * radius ** 2))
+
+    @staticmethod
+    def _grid_offsets(indices, radius):
+        # offsets from the centre of voxels of the block of _squared_norms_grid
+        offsets = np.empty((len(indices), 3), dtype=np.int64)
+        rows, offsets[:, 2] = np.divmod(indices, 2 * radius + 1)
+        offsets[:, 0], offsets[:, 1] = np.divmod(rows, 2 * radius + 1)
+        return offsets - radius
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def ball_kernel(radius):
+        # kernel bank: the masks of morphology.ball, and below the same balls as voxel offsets from their centres
+        return (DAG_Visualizer._squared_norms_grid(radius) <= radius ** 2).reshape((2 * radius + 1,) * 3)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def ball_offsets(radius):
+        norms = DAG_Visualizer._squared_norms_grid(radius)
+        return DAG_Visualizer._grid_offsets(np.flatnonzero(norms <= radius ** 2), radius)
+
+    # kernels of ball_step_kernels computed so far, by radius, previous radius and step
+    step_kernel_bank = {}
+
+    @staticmethod
+    def ball_step_kernels(radius, previous_radius, steps):
+        # voxels of a ball that are not in the ball of previous_radius a step behind it, as offsets from its centre, for
+        # steps (tuples) with sorted non-negative components - stamping them along a centre line grows a tube a slice at
+        # a time; a ball is all voxels up to some squared distance from its centre, so membership is a norm test, done
+        # for all steps missing in the bank at once and only for voxels far enough from the centre
+        bank = DAG_Visualizer.step_kernel_bank
+        missing = np.array([step for step in steps if (radius, previous_radius, step) not in bank], dtype=np.int64).reshape(-1, 3)
+        if len(missing) > 0:
+            norms = DAG_Visualizer._squared_norms_grid(radius)
+            step_norms = np.sum(missing ** 2, axis=1)
+            # (previous_radius, 0, 0) is the farthest voxel of the previous ball
+            previous_reach = previous_radius ** 2
+            nearest = max(0.0, previous_radius - np.sqrt(step_norms.max())) ** 2
+            shell = np.flatnonzero((norms >= int(nearest)) & (norms <= radius ** 2))
+            candidates = DAG_Visualizer._grid_offsets(shell, radius)
+            before = norms[shell].astype(np.int64) + step_norms[:, np.newaxis]
+            for axis in range(3):
+                before += 2 * missing[:, axis, np.newaxis] * candidates[:, axis]
+            step_numbers, candidate_indices = np.nonzero(before > previous_reach)
+            ends = np.cumsum(np.bincount(step_numbers, minlength=len(missing)))
+            offsets = candidates[candidate_indices].astype(np.int16)
+            for step, kernel in zip(missing.tolist(), np.split(offsets, ends[:-1])):
+                bank[(radius, previous_radius, tuple(step))] = kernel
+        return [bank[(radius, previous_radius, step)] for step in steps]
+
+    @staticmethod
+    def tube_kernels(radius, previous_radii, steps):
+        # kernels of tube centres with one radius following centres of previous_radii a step behind them, as offsets and
+        # transforms (signed permutation matrices) of them, a kernel being offsets @ transform: balls are symmetric, so
+        # ball_step_kernels are computed only for steps with sorted non-negative components, kernels of other steps are
+        # their mirror images and permutations
+        axes = np.argsort(np.abs(steps), axis=1, kind='stable')
+        sorted_steps = np.take_along_axis(steps, axes, axis=1)
+        transforms = np.zeros((len(steps), 3, 3), dtype=np.int64)
+        transforms[np.arange(len(steps))[:, np.newaxis], np.arange(3), axes] = np.where(sorted_steps < 0, -1, 1)
+        canonical_steps = [tuple(step) for step in np.abs(sorted_steps).tolist()]
+        kernel_offsets = [None] * len(steps)
+        for previous_radius in np.unique(previous_radii).tolist():
+            kernels = np.flatnonzero(previous_radii == previous_radius).tolist()
+            group_steps = sorted({canonical_steps[kernel] for kernel in kernels})
+            bank = dict(zip(group_steps, DAG_Visualizer.ball_step_kernels(radius, previous_radius, group_steps)))
+            for kernel in kernels:
+                kernel_offsets[kernel] = bank[canonical_steps[kernel]]
+        return kernel_offsets, transforms
+
+    @staticmethod
+    def overlay_volume(dag):
+        return np.zeros(dag.volume_shape, dtype=np.uint8)
+
+    @staticmethod
+    def _compact(dag):
+        return dag if isinstance(dag, CompactDAG) else CompactDAG.from_dag(dag)
+
+    @staticmethod
+    def _labels(value, columns, count):
+        # uint8 labels from a column name, one value per element or a single value (clipped like the colour maps expect),
+        # elements without a value (NaN) get the background label
+        values = columns[value] if isinstance(value, str) else value
+        values = np.nan_to_num(np.asarray(values, dtype=np.float64), nan=0)
+        return np.clip(np.broadcast_to(values, (count,)), 0, 255).astype(np.uint8)
+
+    @staticmethod
+    def _flat(volume):
+        if not volume.flags.c_contiguous:
+            raise ValueError('Overlay volume must be C-contiguous')
+        return volume.reshape(-1), np.array(volume.strides) // volume.itemsize
+
+    @staticmethod
+    def _write(volume, points, values):
+        # volume[points] = values, points outside of the volume are skipped, later points overwrite earlier ones
+        flat, strides = DAG_Visualizer._flat(volume)
+        inside = np.all((points >= 0) & (points < volume.shape), axis=1)
+        flat[points[inside] @ strides] = values[inside]
+        return volume
+
+    @staticmethod
+    def _stamp_blocks(volume, starts, mask, values):
+        # volume[start:start + mask.shape][mask] = value for every start, blocks clipped to the volume
+        starts = np.asarray(starts, dtype=np.int64).reshape(-1, 3)
+        clipped_starts = np.maximum(starts, 0)
+        clipped_stops = np.minimum(starts + mask.shape, volume.shape)
+        visible = np.all(clipped_stops > clipped_starts, axis=1)
+        for start, stop, mask_start, value in zip(clipped_starts[visible].tolist(), clipped_stops[visible].tolist(),
+                                                  (clipped_starts - starts)[visible].tolist(), values[visible].tolist()):
+            block = volume[start[0]:stop[0], start[1]:stop[1], start[2]:stop[2]]
+            block[mask[tuple(slice(m, m + b - a) for a, b, m in zip(start, stop, mask_start))]] = value
+        return volume
+
+    @staticmethod
+    def _stamp(volume, centres, values, kernels, kernel_offsets, transforms, reach):
+        # volume[centre + offset] = value of the centre, for every centre and the offsets of its kernel
+        # (kernel_offsets[kernel] @ transforms[kernel]); writes of a kernel at a time are gathered in a buffer and
+        # scattered together, only centres closer than reach (the largest offset along any axis) to the volume border
+        # have their voxels checked
+        if len(centres) == 0:
+            return volume
+        flat, strides = DAG_Visualizer._flat(volume)
+        inside = np.all(centres >= reach, axis=1) & np.all(centres + reach < volume.shape, axis=1)
+        linear_centres = centres @ strides
+        buffered_points = np.empty(STAMP_CHUNK_SIZE, dtype=np.int64)
+        buffered_values = np.empty(STAMP_CHUNK_SIZE, dtype=volume.dtype)
+        buffered = 0
+        # centres grouped by kernel and by being inside
+        groups = 2 * kernels + ~inside
+        order = np.argsort(groups, kind='stable')
+        group_bounds = np.searchsorted(groups[order], np.arange(2 * len(kernel_offsets) + 1))
+        for group, (first, last) in enumerate(zip(group_bounds[:-1].tolist(), group_bounds[1:].tolist())):
+            kernel, border = divmod(group, 2)
+            offsets, transform = kernel_offsets[kernel], transforms[kernel]
+            if first == last or len(offsets) == 0:
+                continue
+            linear_offsets = offsets @ (transform @ strides)
+            rows = max(1, STAMP_CHUNK_SIZE // len(offsets))
+            for start in range(first, last, rows):
+                chunk = order[start:min(last, start + rows)]
+                if border:
+                    points = (centres[chunk, np.newaxis, :] + offsets @ transform).reshape(-1, 3)
+                    DAG_Visualizer._write(volume, points, np.repeat(values[chunk], len(offsets)))
+                elif len(chunk) * len(offsets) > STAMP_CHUNK_SIZE:
+                    flat[linear_centres[chunk, np.newaxis] + linear_offsets] = values[chunk, np.newaxis]
+                else:
+                    if buffered + len(chunk) * len(offsets) > STAMP_CHUNK_SIZE:
+                        flat[buffered_points[:buffered]] = buffered_values[:buffered]
+                        buffered = 0
+                    shape = (len(chunk), len(offsets))
+                    stop = buffered + len(chunk) * len(offsets)
+                    np.add(linear_centres[chunk, np.newaxis], linear_offsets, out=buffered_points[buffered:stop].reshape(shape))
+                    buffered_values[buffered:stop].reshape(shape)[...] = values[chunk, np.newaxis]
+                    buffered = stop
+        flat[buffered_points[:buffered]] = buffered_values[:buffered]
+        return volume
+
+    @staticmethod
+    def _stamp_balls(volume, centres, radius, values):
+        # big balls are copied into blocks around their centres, small ones scattered
+        if DAG_Visualizer.ball_kernel(radius).size >= BLOCK_KERNEL_SIZE:
+            return DAG_Visualizer._stamp_blocks(volume, centres - radius, DAG_Visualizer.ball_kernel(radius), values)
+        return DAG_Visualizer._stamp(volume, centres, values, np.zeros(len(centres), dtype=np.int64),
+                                     [DAG_Visualizer.ball_offsets(radius)], np.eye(3, dtype=np.int64)[np.newaxis], radius)
+
+    @staticmethod
+    def draw_balls(volume, centres, radii, value):
+        # balls grouped by radius, one batched stamp of a cached kernel per radius
+        centres = np.asarray(centres, dtype=np.int64).reshape(-1, 3)
+        radii = np.broadcast_to(np.asarray(radii).astype(np.int64), (len(centres),))
+        values = DAG_Visualizer._labels(value, None, len(centres))
+        for radius in np.unique(radii).tolist():
+            selected = radii == radius
+            DAG_Visualizer._stamp_balls(volume, centres[selected], radius, values[selected])
+        return volume
+
+    @staticmethod
+    def draw_node_balls(volume, dag, value=2, radius=None):
+        # draw_nodes (radii of nodes) and draw_nodes2 (one radius) of the final-3 and final-4 notebooks
+        dag = DAG_Visualizer._compact(dag)
+        radii = dag.node_columns['radius'] if radius is None else radius
+        return DAG_Visualizer.draw_balls(volume, dag.node_coords, radii,
+                                         DAG_Visualizer._labels(value, dag.node_columns, dag.number_of_nodes))
+
+    @staticmethod
+    def draw_edge_lines(volume, dag, value='mean_radius'):
+        # straight segments between the end nodes of edges, the points of skimage.draw.line_nd for all edges at once
+        dag = DAG_Visualizer._compact(dag)
+        starts = dag.node_coords[dag.edge_node_a].astype(np.float64)
+        stops = dag.node_coords[dag.edge_node_b].astype(np.float64)
+        counts = np.ceil(np.max(np.abs(stops - starts), axis=1)).astype(np.int64)
+        edges = np.repeat(np.arange(dag.number_of_edges), counts)
+        steps = np.arange(len(edges)) - np.repeat(np.cumsum(counts) - counts, counts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            deltas = (stops - starts) / counts[:, np.newaxis]
+        points = np.round(steps[:, np.newaxis] * deltas[edges] + starts[edges]).astype(np.int64)
+        return DAG_Visualizer._write(volume, points, DAG_Visualizer._labels(value, dag.edge_columns, dag.number_of_edges)[edges])
+
+    @staticmethod
+    def draw_edge_voxels(volume, dag, value='mean_radius'):
+        # centre line voxels of edges coloured by a per edge value
+        dag = DAG_Visualizer._compact(dag)
+        values = np.repeat(DAG_Visualizer._labels(value, dag.edge_columns, dag.number_of_edges), dag.edge_voxel_counts())
+        return DAG_Visualizer._write(volume, dag.edge_voxels.astype(np.int64), values)
+
+    @staticmethod
+    def draw_central_line(volume, dag, value=1, node_value=1):
+        dag = DAG_Visualizer._compact(dag)
+        DAG_Visualizer.draw_edge_voxels(volume, dag, value)
+        node_values = DAG_Visualizer._labels(node_value, None, len(dag.node_voxels))
+        return DAG_Visualizer._write(volume, dag.node_voxels.astype(np.int64), node_values)
+
+    @staticmethod
+    def draw_edge_tubes(volume, dag, value='mean_radius', radii='radii_list'):
+        # balls along the centre line of every edge, with radii per voxel (radii_list), per edge or one for all;
+        # a voxel close to the voxel before it (or, first in its edge, to the last voxel of the parent edge) only draws
+        # what its ball adds to the ball there, so every voxel of the tubes is written about once;
+        # all voxels of one radius are stamped together, thicker tubes first, so thinner vessels stay visible
+        # where tubes meet
+        dag = DAG_Visualizer._compact(dag)
+        voxels = dag.edge_voxels.astype(np.int64)
+        counts = dag.edge_voxel_counts()
+        values = np.repeat(DAG_Visualizer._labels(value, dag.edge_columns, dag.number_of_edges), counts)
+        if isinstance(radii, str):
+            radii = dag.edge_voxel_columns[radii] if radii in dag.edge_voxel_columns else np.repeat(dag.edge_columns[radii], counts)
+        radii = np.broadcast_to(np.asarray(radii).astype(np.int64), (len(voxels),))
+
+        previous = np.arange(len(voxels)) - 1
+        parents = dag.parent_edges()
+        first_voxels = dag.edge_voxel_offsets[:-1]
+        has_previous = (counts > 0) & (parents >= 0)
+        has_previous[has_previous] &= counts[parents[has_previous]] > 0
+        previous[first_voxels[counts > 0]] = -1
+        previous[first_voxels[has_previous]] = dag.edge_voxel_offsets[1:][parents[has_previous]] - 1
+
+        # kernel of every voxel continuing a tube: previous radius and index of the step in TUBE_STEPS, -1 for a whole ball
+        kernel_keys = np.full(len(voxels), -1)
+        steps = voxels - voxels[previous]
+        continued = (previous >= 0) & np.all(np.abs(steps) <= TUBE_STEP_REACH, axis=1)
+        kernel_keys[continued] = radii[previous[continued]] * np.prod(TUBE_STEPS) + \
+            np.ravel_multi_index((steps[continued] + TUBE_STEP_REACH).T, TUBE_STEPS)
+
+        for radius in np.unique(radii)[::-1].tolist():
+            selected = np.flatnonzero(radii == radius)
+            whole = selected[kernel_keys[selected] < 0]
+            DAG_Visualizer._stamp_balls(volume, voxels[whole], radius, values[whole])
+            selected = selected[kernel_keys[selected] >= 0]
+            keys, kernels = np.unique(kernel_keys[selected], return_inverse=True)
+            previous_radii, step_indices = np.divmod(keys, np.prod(TUBE_STEPS))
+            steps = np.stack(np.unravel_index(step_indices, TUBE_STEPS), axis=1) - TUBE_STEP_REACH
+            kernel_offsets, transforms = DAG_Visualizer.tube_kernels(radius, previous_radii, steps)
+            DAG_Visualizer._stamp(volume, voxels[selected], values[selected], kernels.ravel(), kernel_offsets, transforms, radius)
+        return volume
+
+    @staticmethod
+    def render_dag(dag, edge_value='mean_radius', node_value=None, node_radius=None, tubes=True):
+        # uint8 label volume of a DAG for QC overlays: edge tubes (or centre lines) coloured by edge_value,
+        # with node balls drawn on top when node_value is given
+        dag = DAG_Visualizer._compact(dag)
+        volume = DAG_Visualizer.overlay_volume(dag)
+        if tubes:
+            DAG_Visualizer.draw_edge_tubes(volume, dag, edge_value)
+        else:
+            DAG_Visualizer.draw_edge_voxels(volume, dag, edge_value)
+        if node_value is not None:
+            DAG_Visualizer.draw_node_balls(volume, dag, node_value, node_radius)
+        return volume
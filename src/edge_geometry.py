@@ -0,0 +1,63 @@
+import numpy as np
+from src.utils import calculate_vectors_relative_angle
+
+EDGE_GEOMETRY_COLUMNS = ('centroid', 'start_direction', 'end_direction', 'relative_angle', 'tortuosity')
+
+
+def segment_means(values, offsets):
+    counts = np.diff(offsets)
+    sums = np.zeros((len(counts),) + values.shape[1:])
+    non_empty = counts > 0
+    if np.any(non_empty):
+        sums[non_empty] = np.add.reduceat(values.astype(np.float64), offsets[:-1][non_empty], axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts.reshape((-1,) + (1,) * (values.ndim - 1))
+
+
+def weighted_directions(voxels, offsets, sources, weights, from_end=False):
+    # batched calculate_direction: weighted average of the first len(weights) voxels
+    # (counted from the end of the edge if from_end) relative to the source point
+    counts = np.diff(offsets)
+    directions = np.zeros((len(counts), 3))
+    weights_sums = np.zeros(len(counts))
+    for i, weight in enumerate(weights):
+        has_voxel = counts > i
+        voxel_indices = offsets[1:][has_voxel] - 1 - i if from_end else offsets[:-1][has_voxel] + i
+        directions[has_voxel] += weight * (voxels[voxel_indices] - sources[has_voxel])
+        weights_sums[has_voxel] += weight
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        directions /= weights_sums[:, np.newaxis]
+        return directions / np.linalg.norm(directions, axis=1, keepdims=True)
+
+
+def calculate_edges_geometry(dag, weights):
+    voxels = dag.edge_voxels
+    offsets = dag.edge_voxel_offsets
+    node_centroids = dag.node_columns['centroid']
+    start_points = node_centroids[dag.edge_node_a]
+    end_points = node_centroids[dag.edge_node_b]
+
+    start_directions = weighted_directions(voxels, offsets, start_points, weights)
+    end_directions = weighted_directions(voxels, offsets, end_points, weights, from_end=True) * (-1)
+
+    parents = dag.parent_edges()
+    relative_angles = calculate_vectors_relative_angle(end_directions[parents], start_directions)
+    relative_angles = np.where(parents >= 0, relative_angles, 0)
+
+    chord_lengths = np.linalg.norm(end_points - start_points, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tortuosities = dag.edge_columns['length'] / chord_lengths
+
+    return {
+        'centroid': segment_means(voxels, offsets),
+        'start_direction': start_directions,
+        'end_direction': end_directions,
+        'relative_angle': relative_angles,
+        'tortuosity': tortuosities,
+    }
+
+
+def set_edges_geometry(dag, weights):
+    for key, values in calculate_edges_geometry(dag, weights).items():
+        dag.set_edge_column(key, values)
@@ -0,0 +1,202 @@
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from src.skeleton_topology import NeighbourTable
+from src.edge_geometry import segment_means
+
+
+class SkeletonGraph:
+    # undirected graph of a skeleton: node regions and edge segments as index arrays into one neighbour table
+    def __init__(self, table, node_voxels, node_offsets, edge_voxels, edge_offsets, edge_node_a, edge_node_b,
+                 bad_edge_voxels, bad_edge_offsets, bad_edge_touching, radii=None):
+        self.table = table
+        self.node_voxels = node_voxels
+        self.node_offsets = node_offsets
+        self.edge_voxels = edge_voxels
+        self.edge_offsets = edge_offsets
+        self.edge_node_a = edge_node_a
+        self.edge_node_b = edge_node_b
+        self.bad_edge_voxels = bad_edge_voxels
+        self.bad_edge_offsets = bad_edge_offsets
+        self.bad_edge_touching = bad_edge_touching
+        self.radii = radii
+
+    @property
+    def shape(self):
+        return self.table.shape
+
+    @property
+    def number_of_nodes(self):
+        return len(self.node_offsets) - 1
+
+    @property
+    def number_of_edges(self):
+        return len(self.edge_offsets) - 1
+
+    @property
+    def number_of_bad_edges(self):
+        return len(self.bad_edge_offsets) - 1
+
+    def node_coords(self):
+        # first voxel of a region in raster order, like regionprops coords[0]
+        return self.table.coords[self.node_voxels[self.node_offsets[:-1]]]
+
+    def node_radii(self):
+        return self.radii[self.node_voxels[self.node_offsets[:-1]]]
+
+    def node_voxels_of(self, node):
+        return self.table.coords[self.node_voxels[self.node_offsets[node]:self.node_offsets[node + 1]]]
+
+    def edge_voxels_of(self, edge):
+        return self.table.coords[self.edge_voxels[self.edge_offsets[edge]:self.edge_offsets[edge + 1]]]
+
+    def bad_edge_voxels_of(self, edge):
+        return self.table.coords[self.bad_edge_voxels[self.bad_edge_offsets[edge]:self.bad_edge_offsets[edge + 1]]]
+
+
+def _group(voxels, labels):
+    # voxels grouped by label (labels numbered from 0), raster order kept inside groups
+    order = np.argsort(labels, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=labels.max() + 1 if len(labels) else 0))])
+    return voxels[order], offsets.astype(np.int64)
+
+
+def _label_components(table, voxels, pairs_a, pairs_b):
+    # 26-connected components of a voxel subset, numbered in raster order of their first voxel (like measure.label)
+    local = np.full(len(table), -1, dtype=np.int64)
+    local[voxels] = np.arange(len(voxels))
+    adjacency = coo_matrix((np.ones(len(pairs_a), dtype=np.int8), (local[pairs_a], local[pairs_b])), shape=(len(voxels), len(voxels)))
+    _, labels = connected_components(adjacency, directed=False)
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(first))
+    return rank[inverse]
+
+
+def polyline_ranks(table, voxels, edge_of, node_of, start_nodes):
+    # multi-source BFS over all edges at once, from edge voxels touching the start node of their edge,
+    # ranks grow with the distance from that node (ties in discovery order)
+    ranks = np.full(len(table), -1, dtype=np.int64)
+    neighbours = table.neighbours[voxels]
+    touches_start = (neighbours >= 0) & (node_of[np.maximum(neighbours, 0)] == start_nodes[edge_of[voxels]][:, np.newaxis])
+    frontier = voxels[touches_start.any(axis=1)]
+
+    rank = 0
+    while len(frontier) > 0:
+        ranks[frontier] = np.arange(rank, rank + len(frontier))
+        rank += len(frontier)
+        candidates = table.neighbours[frontier]
+        valid = candidates >= 0
+        valid &= edge_of[np.maximum(candidates, 0)] == edge_of[frontier][:, np.newaxis]
+        valid &= ranks[np.maximum(candidates, 0)] < 0
+        candidates = candidates[valid]
+        _, first = np.unique(candidates, return_index=True)
+        frontier = candidates[np.sort(first)]
+
+    # voxels not reachable from the start node (should not happen for a connected segment) go last
+    unreached = voxels[ranks[voxels] < 0]
+    ranks[unreached] = np.arange(rank, rank + len(unreached))
+    return ranks[voxels]
+
+
+def build_skeleton_graph(table, is_node, radii=None):
+    voxel_a = np.repeat(np.arange(len(table)), table.neighbours.shape[1])
+    voxel_b = table.neighbours.ravel()
+    present = voxel_b >= 0
+    voxel_a, voxel_b = voxel_a[present], voxel_b[present]
+
+    node_voxels = np.flatnonzero(is_node)
+    edge_voxels = np.flatnonzero(~is_node)
+    both_nodes = is_node[voxel_a] & is_node[voxel_b]
+    both_edges = ~is_node[voxel_a] & ~is_node[voxel_b]
+    node_labels = _label_components(table, node_voxels, voxel_a[both_nodes], voxel_b[both_nodes])
+    segment_labels = _label_components(table, edge_voxels, voxel_a[both_edges], voxel_b[both_edges])
+
+    node_of = np.full(len(table), -1, dtype=np.int64)
+    node_of[node_voxels] = node_labels
+    segment_of = np.full(len(table), -1, dtype=np.int64)
+    segment_of[edge_voxels] = segment_labels
+
+    # distinct (segment, node) pairs of edge voxels touching node voxels
+    touching = ~is_node[voxel_a] & is_node[voxel_b]
+    touching_pairs = np.unique(np.stack([segment_of[voxel_a[touching]], node_of[voxel_b[touching]]], axis=1), axis=0)
+    number_of_segments = segment_labels.max() + 1 if len(segment_labels) else 0
+    touching_count = np.bincount(touching_pairs[:, 0], minlength=number_of_segments)
+    good = touching_count == 2
+
+    pair_offsets = np.concatenate([[0], np.cumsum(touching_count)])
+    good_segments = np.flatnonzero(good)
+    edge_node_a = touching_pairs[pair_offsets[good_segments], 1]
+    edge_node_b = touching_pairs[pair_offsets[good_segments] + 1, 1]
+
+    segment_voxels, segment_offsets = _group(edge_voxels, segment_labels)
+    segment_counts = np.diff(segment_offsets)
+    bad_voxels_buffer = segment_voxels[np.repeat(~good, segment_counts)]
+    node_voxels_buffer, node_offsets = _group(node_voxels, node_labels)
+
+    # edges are emitted as polylines ordered from node_a to node_b
+    edge_of = np.full(len(table), -1, dtype=np.int64)
+    edge_of[segment_voxels] = np.repeat(np.where(good, np.cumsum(good) - 1, -1), segment_counts)
+    good_voxels = segment_voxels[np.repeat(good, segment_counts)]
+    ranks = polyline_ranks(table, good_voxels, edge_of, node_of, edge_node_a)
+    edge_voxels_buffer = good_voxels[np.lexsort((ranks, edge_of[good_voxels]))]
+
+    return SkeletonGraph(
+        table,
+        node_voxels_buffer, node_offsets,
+        edge_voxels_buffer, np.concatenate([[0], np.cumsum(segment_counts[good])]).astype(np.int64),
+        edge_node_a, edge_node_b,
+        bad_voxels_buffer, np.concatenate([[0], np.cumsum(segment_counts[~good])]).astype(np.int64),
+        touching_count[~good],
+        radii)
+
+
+def construct_graph(skeleton, nodes_mask, skeleton_thickness):
+    table = NeighbourTable.from_volume(skeleton)
+    voxels = tuple(table.coords.T)
+    graph = build_skeleton_graph(table, np.asarray(nodes_mask)[voxels] > 0, np.asarray(skeleton_thickness)[voxels])
+    print('nodes found (regions on nodes mask):', graph.number_of_nodes)
+    print('edges found:', graph.number_of_edges + graph.number_of_bad_edges)
+    touching, counts = np.unique(graph.bad_edge_touching, return_counts=True)
+    for touching_nodes, count in zip(touching, counts):
+        print(f'bad edges found! {count} edges found touching {touching_nodes} nodes')
+    return graph
+
+
+def polyline_lengths(voxels, offsets, starts, ends, chunk_length=1):
+    # length of every polyline from its start point through centroids of chunk_length consecutive voxels to its
+    # end point (calculate_edge_length of the final-3 notebooks), voxels of all polylines in one buffer
+    counts = np.diff(offsets)
+    if len(counts) == 0:
+        return np.zeros(0)
+    coords = np.asarray(voxels, dtype=np.float64)
+    chunks = (np.arange(len(coords)) - np.repeat(offsets[:-1], counts)) // chunk_length
+    chunk_counts = -(-counts // chunk_length)
+    chunk_offsets = np.concatenate([[0], np.cumsum(chunk_counts)])
+    chunk_ids = np.repeat(chunk_offsets[:-1], counts) + chunks
+    chunk_sizes = np.bincount(chunk_ids, minlength=chunk_offsets[-1])
+    chunk_centroids = np.stack([np.bincount(chunk_ids, coords[:, i], chunk_offsets[-1]) for i in range(3)], axis=1) / chunk_sizes[:, np.newaxis]
+
+    # path points of polyline e: start, its chunk centroids, end - steps between consecutive polylines are dropped
+    points = np.insert(chunk_centroids, chunk_offsets[:-1], starts, axis=0)
+    points = np.insert(points, chunk_offsets[1:] + np.arange(1, len(counts) + 1), ends, axis=0)
+    steps = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    point_offsets = chunk_offsets + 2 * np.arange(len(counts) + 1)
+    steps[point_offsets[1:-1] - 1] = 0
+    return np.add.reduceat(steps, point_offsets[:-1])
+
+
+def populate_dag(dag, skeleton_thickness, chunk_length=1):
+    # basic metadata of a CompactDAG from compress_tree, like the final-3 notebooks: node radius as the mean
+    # thickness of its voxels and centroid, thickness of every edge voxel, its mean and the edge length
+    skeleton_thickness = np.asarray(skeleton_thickness)
+    node_thickness = skeleton_thickness[tuple(dag.node_voxels.T)]
+    edge_thickness = skeleton_thickness[tuple(dag.edge_voxels.T)]
+    centroids = segment_means(dag.node_voxels.astype(np.float64), dag.node_voxel_offsets)
+    dag.set_node_column('radius', segment_means(node_thickness, dag.node_voxel_offsets))
+    dag.set_node_column('centroid', centroids)
+    dag.set_edge_voxel_column('radii_list', edge_thickness)
+    dag.set_edge_column('mean_radius', segment_means(edge_thickness, dag.edge_voxel_offsets))
+    dag.set_edge_column('length', polyline_lengths(
+        dag.edge_voxels, dag.edge_voxel_offsets, centroids[dag.edge_node_a], centroids[dag.edge_node_b], chunk_length))
+    return dag
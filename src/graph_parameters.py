@@ -1,14 +1,19 @@
+import os
 from src.dag import DAG
 from src.node import Node
 from src.edge import Edge
-from src.dag_visualizer import DAG_Visualizer
-from src.utils import load_dag, save_dag, calculate_vectors_relative_angle, calculate_direction, generational_diff
+from src.dag_storage import load_dag, save_dag
+from src.volume_io import load_reconstruction, iter_slabs
+from src.utils import generational_diff
+from src.edge_geometry import set_edges_geometry, EDGE_GEOMETRY_COLUMNS
+from src.spatial_index import EdgeSpatialIndex
+from src.stage_cache import StageCache
+from src.tiling import mean_distance_to_foreground
+from src.projection_metrics import projection_contour, box_counting_fit
+from src.lacunarity import lacunarity_2d, lacunarity_3d
+from src.projection import volume_projection, central_line_projection, matches_projection, rasterise_projection, set_voxels_2d
 import numpy as np
-from sklearn.decomposition import PCA
-from sklearn.linear_model import LinearRegression
 from skimage.morphology import convex_hull_image
-from scipy.signal import fftconvolve
-from scipy.ndimage import zoom
 
 class GraphParameters:
     def __init__(self, 
@@ -16,64 +21,144 @@ class GraphParameters:
             reconstruction_path = None,  # path to reconstruction (if want to get 3d parameters)
             max_gen = 8,
             edge_dir_weights = [1, 1, 1, 1, 1, 0.8, 0.8, 0.6, 0.2],
-            dag_id: str = ""):
+            dag_id: str = "",
+            mmap_mode = None, # e.g. 'r' to read the reconstruction from disk slab by slab
+            interstitial_from_voxels = False, # nearest vessel measured to centre-line voxels instead of edge centroids
+            save = True, # write the graph with stats next to the graph file and to results/
+            cache_dir = None, # directory of the stage cache, stages with unchanged inputs are then loaded from it
+            cache_max_bytes = 4 * 1024**3,
+            render = True, # draw figures to results/ at the end, otherwise they are kept in renders for render()
+            calculate_lacunarity_3d = False): # also calculate lacunarity of the 3d reconstruction
         
         self.dag_id = dag_id
+        self.stage_cache = StageCache(cache_dir, cache_max_bytes) if cache_dir else None
+        self.renders = []
 
         print(f"Loading graph file {graph_path}...")
         self.load_graph(graph_path)
+        graph_hash = self.file_hash(graph_path)
 
-        print(f"Calculating centroid of edges...")
-        self.set_centroid_to_edges()
+        print("Calculating edge centroids, directions, relative angles(bifurcation angles) and tortuosity...")
+        geometry = self.run_stage('edge_geometry', lambda: self.set_edges_geometry(edge_dir_weights),
+            [graph_hash, edge_dir_weights], edge_columns=EDGE_GEOMETRY_COLUMNS)
         self.add_parent_to_nodes()
 
-        print("Calculating edge directions...")
-        self.set_edges_directions(edge_dir_weights)
-
-        print("Calculating edges relative angles(bifurcation angles)...")
-        self.set_edges_relative_angles(self.dag.root)
-
-        print("Calculating tortuosity...")
-        self.set_edges_tortuosities()
-
         print("Getting information about generations of edges...")
-        self.find_edges_generation(max_gen)
+        self.run_stage('generations', lambda: self.find_edges_generation(max_gen),
+            [geometry, max_gen], edge_columns=['generation'])
 
         print("Getting information about number of vessels...")
-        self.get_number_of_vessels()
+        self.run_stage('number_of_vessels', self.get_number_of_vessels,
+            [graph_hash], data=['number_of_vessels'])
 
         print("Getting information about vessel average and total length...")
-        self.get_vessel_length()
+        self.run_stage('vessel_length', self.get_vessel_length,
+            [graph_hash], data=['vessel_total_length', 'vessel_avg_length'])
 
         print("Getting information about interstitial distances to nearest vessels...")
-        self.set_interstitial_distances()
+        self.run_stage('interstitial_distances', lambda: self.set_interstitial_distances(interstitial_from_voxels),
+            [geometry, interstitial_from_voxels], edge_columns=['interstitial_distance'])
 
         # parameters absed on reconstruction instead of graph
         if reconstruction_path:
             print("Loading reconstruction...")
-            self.reconstruction = np.load(reconstruction_path)
+            self.reconstruction = load_reconstruction(reconstruction_path, mmap_mode)
+            reconstruction_hash = self.file_hash(reconstruction_path)
 
             print("Getting information about volume filled with vascular structure...")
-            self.get_volume_filled_with_vascular_structure()
+            self.run_stage('vascular_structure_volume', self.get_volume_filled_with_vascular_structure,
+                [reconstruction_hash], data=['vascular_structure_volume'])
+
+            print("Getting information about mean interstitial distance of tissue to nearest vessel...")
+            self.run_stage('mean_interstitial_distance', self.get_mean_interstitial_distance,
+                [reconstruction_hash], data=['mean_interstitial_distance'])
 
             print("Getting vascular network area in 2d")
-            self.get_vascular_network_area()
+            projection = self.run_stage('vascular_network_area', self.get_vascular_network_area,
+                [reconstruction_hash], data=['projection', 'vascular_network_projection_area'], attributes=['reconstruction_projection_mask'])
 
             print("Getting vascular density...")
-            self.vascular_density()
+            self.run_stage('vascular_density', self.vascular_density,
+                [projection], data=['projection_explant_area', 'vascular_density'], attributes=['convex_projection'])
 
             print("Calculating branching index...")
-            self.get_branching_index()
+            self.run_stage('branching_index', self.get_branching_index,
+                [graph_hash, projection], data=['branching_points', 'branchings_points_per_pixel'])
 
             print("Calcularing lacunarity")
-            self.get_lacunarity()
+            self.run_stage('lacunarity', self.get_lacunarity, [projection], data=['lacunarity'])
+
+            if calculate_lacunarity_3d:
+                print("Calcularing 3d lacunarity")
+                self.run_stage('lacunarity_3d', self.get_lacunarity_3d, [reconstruction_hash], data=['lacunarity_3d'])
 
             print("Calculating fractal dimension")
-            self.fractal_dimension()
+            self.run_stage('fractal_dimension', self.fractal_dimension, [projection], data=['fractal_dimension'])
+
+        print("Mapping voxels of nodes and edges to 2d...")
+        self.set_voxels_2d()
 
-        print("Saving graph file...")
-        save_dag(self.dag, f"results/{self.dag_id}_dag_with_stats.pkl")
-        save_dag(self.dag, graph_path.replace('dag.pkl', 'dag_with_stats.pkl'))
+        if render and len(self.renders) > 0:
+            print("Rendering figures...")
+            self.render()
+
+        if save:
+            print("Saving graph file...")
+            save_dag(self.dag, f"results/{self.dag_id}_dag_with_stats.npz")
+            save_dag(self.dag, os.path.join(os.path.dirname(graph_path), 'dag_with_stats.npz'))
+
+
+    ####################################################################################
+    #                                   STAGE CACHE                                    #
+    ####################################################################################
+
+    def file_hash(self, filename):
+        return self.stage_cache.file_hash(filename) if self.stage_cache else None
+
+    def run_stage(self, name, stage, inputs, edge_columns=(), data=(), attributes=()):
+        # inputs hold hashes of files and keys of upstream stages, so a change invalidates all dependent stages
+        if self.stage_cache is None:
+            stage()
+            return None
+
+        key = self.stage_cache.key(name, inputs)
+        outputs = self.stage_cache.load(key)
+        if outputs is None:
+            stage()
+            outputs = {f'edge_columns/{k}': self.dag.edge_columns[k] for k in edge_columns}
+            for k in data:
+                values = self.dag[k] if isinstance(self.dag[k], dict) else {None: self.dag[k]}
+                outputs.update({f'data/{k}' if sub is None else f'data/{k}/{sub}': np.asarray(v) for sub, v in values.items()})
+            outputs.update({f'attributes/{k}': getattr(self, k) for k in attributes})
+            self.stage_cache.store(key, outputs)
+            return key
+
+        for output, value in outputs.items():
+            group, k = output.split('/', 1)
+            if group == 'edge_columns':
+                self.dag.set_edge_column(k, value)
+            elif group == 'data':
+                *path, k = k.split('/')
+                target = self.dag.data
+                for part in path:
+                    target = target.setdefault(part, {})
+                target[k] = value.item() if value.ndim == 0 else value
+            else:
+                setattr(self, k, value)
+        return key
+
+
+    ####################################################################################
+    #                                    RENDERING                                     #
+    ####################################################################################
+
+    def add_render(self, name, *args):
+        # figures are only drawn in render(), so computing parameters never needs matplotlib
+        self.renders.append((name, args))
+
+    def render(self):
+        render_figures(self.renders)
+        self.renders = []
 
 
     ####################################################################################
@@ -88,12 +173,12 @@ class GraphParameters:
             
 
     ####################################################################################
-    #                                CENTROID, PARENT                                  #
+    #                      EDGE GEOMETRY (CENTROID, DIRECTIONS, ...)                   #
     ####################################################################################
 
-    def set_centroid_to_edges(self):
-        for e in self.dag.edges:
-            e['centroid'] = np.mean(e['voxels'], axis=0)
+    def set_edges_geometry(self, weights=[1, 1, 1, 1, 0.6, 0.2]):
+        # centroids, start / end directions, bifurcation angles and tortuosity of all edges at once
+        set_edges_geometry(self.dag, weights)
 
     def add_parent_to_nodes(self):
         self.dag.root['parent'] = None
@@ -102,103 +187,42 @@ class GraphParameters:
 
 
     ####################################################################################
-    #                                 EDGE DIRECTIONS                                  #
-    ####################################################################################
-
-    def calculate_edge_directions(self, edge, weights):
-        start_point = edge.node_a['centroid']
-        end_point = edge.node_b['centroid']
-        start_direction = calculate_direction(start_point, edge['voxels'], weights)
-        end_direction = calculate_direction(end_point, np.flip(edge['voxels'], axis=0), weights) * (-1)
-        return start_direction, end_direction
-
-    def set_edges_directions(self, weights=[1, 1, 1, 1, 0.6, 0.2]): 
-        for edge in self.dag.edges:
-            start_direction, end_direction = self.calculate_edge_directions(edge, weights)
-            edge['start_direction'] = start_direction
-            edge['end_direction'] = end_direction
-   
-
-    ####################################################################################
-    #                              EDGE RELATIVE ANGLES                                #
-    ####################################################################################
-
-    def set_edges_relative_angles(self, node, parent_edge=None):
-        for edge in node.edges:
-            if parent_edge is not None:
-                edge['relative_angle'] = calculate_vectors_relative_angle(
-                    parent_edge['end_direction'], edge['start_direction'])
-            else:
-                edge['relative_angle'] = 0
-                    
-            self.set_edges_relative_angles(edge.node_b, edge)
-
-
-    ####################################################################################
-    #                                   TORTUOSITY                                     #
+    #                                  GENERATIONS                                     #
     ####################################################################################
 
-    def set_edges_tortuosities(self): 
-        for edge in self.dag.edges:
-            chord_length = np.linalg.norm(edge.node_b['centroid'] - edge.node_a['centroid'])
-            edge['tortuosity'] = edge['length'] / chord_length
+    def find_edges_generation(self, max_gen=np.inf, max_angle = np.pi / 6, max_thick_diff = 0.7):
+        parents = self.dag.parent_edges()
+        relative_angles = self.dag.edge_columns['relative_angle']
+        mean_radii = self.dag.edge_columns['mean_radius']
+        generations = np.zeros(self.dag.number_of_edges, dtype=np.int64)
 
+        # parents generations are known once the previous depth level is done
+        for level in self.dag.edge_levels():
+            level_parents = parents[level]
+            same_generation = generational_diff(
+                {'mean_radius': mean_radii[level_parents]},
+                {'relative_angle': relative_angles[level], 'mean_radius': mean_radii[level]},
+                max_angle, max_thick_diff)
+            level_generations = np.where(same_generation, generations[level_parents], generations[level_parents] + 1)
+            level_generations[level_parents < 0] = 1
 
-    ####################################################################################
-    #                                  GENERATIONS                                     #
-    ####################################################################################
+            # if we reach max_gen every other gen is max_gen + 1
+            generations[level] = np.minimum(level_generations, max_gen + 1)
 
-    def find_edges_generation(self, max_gen=np.inf, max_angle = np.pi / 6, max_thick_diff = 0.7):
-        for e in self.dag.root.edges:
-            self.get_edges_generation(e, None, max_gen, max_angle, max_thick_diff)
-
-    def get_edges_generation(self, edge: Edge, parent=None, max_gen=np.inf, max_angle = np.pi / 6, max_thick_diff = 0.7):
-        # basic condition for root
-        if parent is None: 
-            edge['generation'] = 1
-        else:
-            if generational_diff(parent, edge, max_angle, max_thick_diff):
-                edge['generation'] = parent['generation']
-            else:
-                edge['generation'] = parent['generation'] + 1
-        
-        # if we reach max_gen every other gen is max_gen + 1
-        if edge['generation'] > max_gen:
-            edge['generation'] = max_gen + 1
-                
-        for e in edge.node_b.edges:
-            self.get_edges_generation(e, edge, max_gen, max_angle, max_thick_diff)
+        self.dag.set_edge_column('generation', generations)
 
 
     ####################################################################################
     #                           VESSELS COUNT + LENGTH                                 #
     ####################################################################################
 
-    def vessels_recursive(self, node):
-        if len(node.edges) == 0:
-            return 1
-        
-        count = 0
-        for e in node.edges:
-            count += self.vessels_recursive(e.node_b)
-        return count
-
-    def vessel_length_recursive(self, edge):
-        if len(edge.node_b.edges) == 0:
-            return edge['length']
-        
-        count = 0
-        for e in edge.node_b.edges:
-            count += self.vessel_length_recursive(e)
-        return count
-
     def get_number_of_vessels(self):
-        self.dag['number_of_vessels'] = self.vessels_recursive(self.dag.root)
+        # every vessel ends in a leaf node
+        self.dag['number_of_vessels'] = int(np.sum(self.dag.children_count() == 0))
 
     def get_vessel_length(self):
-        vessel_length = 0
-        for e in self.dag.root.edges:
-            vessel_length +=  self.vessel_length_recursive(e)
+        leaf_edges = self.dag.children_count()[self.dag.edge_node_b] == 0
+        vessel_length = np.sum(self.dag.edge_columns['length'][leaf_edges])
 
         self.dag['vessel_total_length'] = vessel_length
         self.dag['vessel_avg_length'] = vessel_length / self.dag['number_of_vessels']
@@ -207,22 +231,34 @@ class GraphParameters:
     #                              INTERSTITIAL DISTANCE                               #
     ####################################################################################
     
-    def get_interstitial_distances(self, edge):
-        if len(edge.node_b.edges) == 0:
-            edge['interstitial_distance'] = np.linalg.norm(edge.node_b['centroid'] - edge['centroid'])
-        else:
-            edges = edge.node_b.edges
-            min_val = np.inf
-            for e in edges:
-                self.get_interstitial_distances(e)
-                dist =  np.linalg.norm(edge['centroid'] - e['centroid']) + e['interstitial_distance']
-                if dist < min_val:
-                    min_val = dist
-            edge['interstitial_distance'] = min_val
-
-    def set_interstitial_distances(self):
-        for e in self.dag.root.edges:
-            self.get_interstitial_distances(e)
+    def set_interstitial_distances(self, use_voxels=False):
+        # distance from every edge centroid to the nearest edge outside of its own lineage
+        spatial_index = EdgeSpatialIndex(self.dag, use_voxels)
+        distances = spatial_index.nearest_unrelated_distances(
+            self.dag.edge_columns['centroid'], np.arange(self.dag.number_of_edges))
+        self.dag.set_edge_column('interstitial_distance', distances)
+
+    def get_mean_interstitial_distance(self):
+        # mean distance from tissue voxels to the nearest vessel voxel, within the reconstruction bounding box
+        bounds = self.get_reconstruction_bounds()
+        if bounds is None:
+            self.dag['mean_interstitial_distance'] = np.nan
+            return
+        # a large bounding box is transformed slab by slab, a whole specimen does not fit in memory as one transform
+        self.dag['mean_interstitial_distance'] = mean_distance_to_foreground(self.reconstruction, *bounds)
+
+    def get_reconstruction_bounds(self):
+        z_filled = []
+        y_filled = np.zeros(self.reconstruction.shape[1], dtype=bool)
+        x_filled = np.zeros(self.reconstruction.shape[2], dtype=bool)
+        for _, slab in iter_slabs(self.reconstruction):
+            z_filled.append(np.any(slab, axis=(1, 2)))
+            y_filled |= np.any(slab, axis=(0, 2))
+            x_filled |= np.any(slab, axis=(0, 1))
+        filled = [np.flatnonzero(f) for f in (np.concatenate(z_filled), y_filled, x_filled)]
+        if len(filled[0]) == 0:
+            return None
+        return tuple(f[0] for f in filled), tuple(f[-1] + 1 for f in filled)
 
 
     ####################################################################################
@@ -230,7 +266,7 @@ class GraphParameters:
     ####################################################################################
 
     def get_volume_filled_with_vascular_structure(self):
-        self.dag['vascular_structure_volume'] = np.sum(self.reconstruction > 0)
+        self.dag['vascular_structure_volume'] = sum(np.count_nonzero(slab) for _, slab in iter_slabs(self.reconstruction))
         # sum = 0
         # for e in self.dag.edges:
         #     sum += 2/3 * len(e['voxels']) * e['mean_radius'] * e['mean_radius'] * np.pi
@@ -241,22 +277,22 @@ class GraphParameters:
     #                          AREA COVERED BY VASCULAR NETWORK                        #
     ####################################################################################
 
-    def project_reconstruction(self):
-        reconstruction_coords = np.argwhere(self.reconstruction > 0)
-        pca = PCA(n_components=2)
-        pca.fit(reconstruction_coords)
-        return pca.transform(reconstruction_coords)
-
     def get_vascular_network_area(self):
-        reconstruction_projection = self.project_reconstruction()
-        rounded_reconstruction_projection = np.round(reconstruction_projection)
-        mins = np.min(reconstruction_projection, axis=0)
-        shifted_projection = (rounded_reconstruction_projection - mins).astype(np.int)
-        self.reconstruction_projection_mask = np.zeros(np.max(shifted_projection + 1, axis=0), dtype=np.bool)
-        self.reconstruction_projection_mask[shifted_projection[:, 0], shifted_projection[:, 1]] = 1
-        DAG_Visualizer.vascular_network_area(self.reconstruction_projection_mask, self.dag_id)
+        # projection basis is reused when the graph already holds one fitted on this reconstruction
+        projection = self.dag.data.get('projection')
+        if not matches_projection(projection, 'reconstruction', self.reconstruction.shape, self.dag['vascular_structure_volume']):
+            projection = volume_projection(self.reconstruction)
+            self.dag['projection'] = projection
+        self.reconstruction_projection_mask = rasterise_projection(self.reconstruction, projection)
+        self.add_render('vascular_network_area', self.reconstruction_projection_mask, self.dag_id)
         self.dag['vascular_network_projection_area'] = np.sum(self.reconstruction_projection_mask)
 
+    def set_voxels_2d(self):
+        # without a reconstruction the basis is fitted on the central line voxels
+        if 'projection' not in self.dag.data:
+            self.dag['projection'] = central_line_projection(self.dag)
+        set_voxels_2d(self.dag, self.dag['projection'])
+
 
     ####################################################################################
     #                                   VASCULAR DENSITY                               #
@@ -264,7 +300,7 @@ class GraphParameters:
 
     def vascular_density(self):
         self.convex_projection = convex_hull_image(self.reconstruction_projection_mask)
-        DAG_Visualizer.vascular_density(self.convex_projection, self.dag_id)
+        self.add_render('vascular_density', self.convex_projection, self.dag_id)
         self.dag['projection_explant_area'] = self.convex_projection.sum()
         self.dag['vascular_density'] = self.dag['vascular_network_projection_area'] / self.dag['projection_explant_area']
 
@@ -287,23 +323,14 @@ class GraphParameters:
     #                                     LACUNARITY                                   #
     ####################################################################################
 
-    def calculate_one_box_lacunarity(self, box_size):
-        box = np.ones((box_size, box_size))
-        convolution = fftconvolve(self.reconstruction_projection_mask, box, mode='valid')
-        mean_sqrd = np.mean(convolution)**2
-        if mean_sqrd == 0:
-            return 0.0
-        return (np.var(convolution) / mean_sqrd) + 1
-
-    def calculate_avg_lacunarity(self, box_sizes):
-        lacunarities = []
-        for box_size in box_sizes:
-            lacunarities.append(self.calculate_one_box_lacunarity(box_size))
-        return np.mean(lacunarities)
+    def get_lacunarity(self, box_sizes=[10, 30, 50, 70, 90, 110, 130, 150], gliding=True):
+        self.dag['lacunarity'] = np.nanmean(lacunarity_2d(self.reconstruction_projection_mask, box_sizes, gliding))
 
-    def get_lacunarity(self):
-        box_sizes = [10, 30, 50, 70, 90, 110, 130, 150]
-        self.dag['lacunarity'] = self.calculate_avg_lacunarity(box_sizes)
+    def get_lacunarity_3d(self, box_sizes=[10, 30, 50, 70, 90, 110, 130, 150], gliding=True):
+        # on the reconstruction itself, streamed slab by slab within its bounding box
+        bounds = self.get_reconstruction_bounds()
+        lacunarities = lacunarity_3d(self.reconstruction, box_sizes, gliding, bounds=bounds) if bounds else [np.nan]
+        self.dag['lacunarity_3d'] = np.nanmean(lacunarities)
 
 
     ####################################################################################
@@ -311,27 +338,19 @@ class GraphParameters:
     ####################################################################################
 
     def get_projection_contour(self):
-        padded_projection = np.pad(self.reconstruction_projection_mask, 1)
-        contour = np.zeros(padded_projection.shape)
-        projection_pixels = np.argwhere(padded_projection)
-        kernel = np.ones((3, 3))
-        kernel[1, 1] = 0
-        for pixel in projection_pixels:
-            x, y = tuple(pixel)
-            projection_slice = padded_projection[x-1 : x+2, y-1 : y+2]
-            if np.sum(projection_slice * kernel) < 8:
-                contour[x, y] = 1
-        return contour[1:-1, 1:-1]
+        return projection_contour(self.reconstruction_projection_mask)
 
     def fractal_dimension(self):
-        contours_lengths =[]
-        scales = np.arange(1, 0.1, -0.1)
+        # box-counting dimension of the projection contour on the full resolution mask
+        contour = self.get_projection_contour()
+        fit = box_counting_fit(contour)
+        self.dag['fractal_dimension'] = fit['dimension']
 
-        scales, contours_lengths = DAG_Visualizer.visualize_contours(scales, contours_lengths, self.reconstruction_projection_mask, self.get_projection_contour, self.dag_id)
+        self.add_render('box_counting', contour, fit['box_sizes'], fit['counts'], fit['dimension'], fit['intercept'], self.dag_id)
 
-        X = np.expand_dims(np.log(scales), axis=-1)
-        y = np.expand_dims(np.log(contours_lengths), axis=-1)
-        lm = LinearRegression().fit(X, y)
-        self. dag['fractal_dimension'] = lm.coef_[0, 0]
 
-        DAG_Visualizer.scales_contour_lengths(scales, contours_lengths, lm, self.dag_id)
+def render_figures(renders):
+    # draws figures queued by GraphParameters.add_render, also in another process than the one that queued them
+    from src.dag_visualizer import DAG_Visualizer
+    for name, args in renders:
+        getattr(DAG_Visualizer, name)(*args)
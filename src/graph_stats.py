@@ -1,150 +1,143 @@
 from src.dag import DAG
-import matplotlib.pyplot as plt
+from src.compact_dag import CompactDAG
 import numpy as np
+import pandas as pd
 import csv
 
+# edge metrics of the stats: name -> (edge column, scale of its values)
+EDGE_METRICS = {
+    'length': ('length', 1),
+    'diameter': ('mean_radius', 1),
+    'bifurcation_angle': ('relative_angle', 180 / np.pi),
+    'tortuosity': ('tortuosity', 1),
+    'interstitial_distance': ('interstitial_distance', 1),
+}
+SUMMARY_PERCENTILES = (0.25, 0.5, 0.75)
+
+# figures of the metrics: (metric, file suffix, histogram title, x label, bins, per generation title, per generation y label)
+METRIC_FIGURES = (
+    ('length', 'lengths', 'lengths count', 'length', 10, 'lengths per generation', 'lengths'),
+    ('diameter', 'diameters', 'lengths count', 'diameter', 8, 'diameters per generation', 'diameters'),
+    ('bifurcation_angle', 'bifurcation_angles', 'bifurcation angles count', 'angle', 18,
+        'bifurcation angles per generation', 'angles'),
+    ('tortuosity', 'tortuosities', 'segments tortuosisities count', 'tortuosities segments', 8,
+        'segments tortuosities per generation', 'tortuosities segments'),
+    ('interstitial_distance', 'interstitial_distance', 'interstitial distances', 'interstitial distance', 8,
+        'interstitial distances per generation', 'interstitial distance'),
+)
+
+
+def render_figure(figure):
+    # draws one figure description of GraphStats.figures() to a file, with its own Figure object (no global pyplot
+    # state), so figures can be drawn in worker processes
+    from matplotlib.figure import Figure
+    kind, path, title, data, x_label, y_label, options = figure
+    plot = Figure()
+    axis = plot.subplots()
+    axis.set_title(title)
+    getattr(axis, kind)(data, **options)
+    axis.set_xlabel(x_label)
+    axis.set_ylabel(y_label)
+    plot.savefig(path)
+
+
 class GraphStats:
     def __init__(self, dag: DAG, dag_id: str = "", max_gen: int = 8):
-        self.dag = dag
+        self.dag = dag if isinstance(dag, CompactDAG) else CompactDAG.from_dag(dag)
         self.dag_id = dag_id
         self.max_gen = max_gen
+        self._metrics = None
 
-    def generate_all_stats(self):
-        print("Generating stats about edges in graph")
-        self.mean_length()
-
-        print("Generating stats about mean diameter in graph")
-        self.mean_diameter()
-
-        print("Generating stats about bifurcation angles in graph")
-        self.bifurcation_angles()
-
-        print("Generating stats about tortuosities segments in graph")
-        self.tortuosities()
-
-        print("Generating stats about interstitial distances")
-        self.interstitial_distances()
+    def generate_all_stats(self, render=True, pool=None):
+        # the numbers are ready before any figure is drawn; with a pool figures are drawn by its workers,
+        # generate_all_stats then returns without waiting for them
+        print("Extracting edge metrics of graph")
+        summary = self.summary()
 
         print("Saving graph stats to CSV")
         self.save_graph_stats_to_csv()
-
-    def stats_per_gen(self, stat):
-        stats = [lg[0] for lg in stat]
-        gens = [lg[1] for lg in stat]
-        stats_per_gen = [[] for _ in range(max(gens))]
-        for lg in stat:
-            stats_per_gen[lg[1]-1].append(lg[0])
-        return stats, gens, stats_per_gen
+        summary.to_csv(f"results/{self.dag_id}_stats_per_generation.csv")
+
+        if render:
+            print("Rendering graph stats figures")
+            self.render(pool)
+        return summary
+
+    def metrics(self):
+        # one row per edge up to max_gen: its generation and all edge metrics available in the graph,
+        # bifurcation angle of the first edge is left out (it has no parent)
+        if self._metrics is None:
+            generations = np.asarray(self.dag.edge_columns['generation'])
+            columns = {'generation': generations}
+            for name, (column, scale) in EDGE_METRICS.items():
+                if column in self.dag.edge_columns:
+                    columns[name] = np.asarray(self.dag.edge_columns[column], dtype=np.float64) * scale
+            if 'bifurcation_angle' in columns and len(generations) > 0:
+                columns['bifurcation_angle'][0] = np.nan
+            metrics = pd.DataFrame(columns)
+            self._metrics = metrics[metrics['generation'] <= self.max_gen].reset_index(drop=True)
+        return self._metrics
+
+    def summary(self):
+        # count, mean, std, min, quartiles and max of every metric per generation
+        return self.metrics().groupby('generation').describe(percentiles=SUMMARY_PERCENTILES)
+
+    def metric_summary(self, name):
+        return self.summary()[name]
 
     def mean_length(self):
-        lengths_generations = [(edge['length'], edge['generation']) for edge in self.dag.edges]
-        lengths_generations = list(filter(lambda x: x[1] <= self.max_gen, lengths_generations))
-        lengths, generations, lengths_per_gen = self.stats_per_gen(lengths_generations)
-        edges_per_gen = [len(eg) for eg in lengths_per_gen]
-
-        plt.title('lengths count')
-        plt.hist(lengths)
-        plt.xlabel('length')
-        plt.ylabel('count')
-        plt.savefig(f"results/{self.dag_id}_lengths")
-        plt.clf()
-
-        plt.title('lengths per generation')
-        plt.boxplot(lengths_per_gen)
-        plt.xlabel('generation')
-        plt.ylabel('lengths')
-        plt.savefig(f"results/{self.dag_id}_lengths_per_generation")
-        plt.clf()
-
-        plt.title('edges per generation')
-        plt.boxplot(edges_per_gen)
-        plt.xlabel('generation')
-        plt.ylabel('edges count')
-        plt.savefig(f"results/{self.dag_id}_edges_per_generation")
-        plt.clf()
+        return self.metric_summary('length')
 
     def mean_diameter(self):
-        diameters_generations = [(edge['mean_radius'], edge['generation']) for edge in self.dag.edges]
-        diameters_generations = list(filter(lambda x: x[1] <= self.max_gen, diameters_generations))
-        diameters, generations, diameters_per_gen = self.stats_per_gen(diameters_generations)
-
-        plt.title('lengths count')
-        plt.hist(diameters, bins=8)
-        plt.xlabel('diameter')
-        plt.ylabel('count')
-        plt.savefig(f"results/{self.dag_id}_diameters")
-        plt.clf()
-
-        plt.title('diameters per generation')
-        plt.boxplot(diameters_per_gen)
-        plt.xlabel('generation')
-        plt.ylabel('diameters')
-        plt.savefig(f"results/{self.dag_id}_diameters_per_generation")
-        plt.clf()
+        return self.metric_summary('diameter')
 
     def bifurcation_angles(self):
-        angles_generations = [(edge['relative_angle'] / np.pi * 180, edge['generation']) for edge in self.dag.edges[1:]]
-        angles_generations = list(filter(lambda x: x[1] <= self.max_gen, angles_generations))
-        angles, generations, angles_per_gen = self.stats_per_gen(angles_generations)
-
-        plt.title('bifurcation angles count')
-        plt.hist(angles, bins=18)
-        plt.xlabel('angle')
-        plt.ylabel('count')
-        plt.savefig(f"results/{self.dag_id}_bifurcation_angles")
-        plt.clf()
-
-        plt.title('bifurcation angles per generation')
-        plt.boxplot(angles_per_gen)
-        plt.xlabel('generation')
-        plt.ylabel('angles')
-        plt.savefig(f"results/{self.dag_id}_bifurcation_angles_per_generation")
-        plt.clf()
+        return self.metric_summary('bifurcation_angle')
 
     def tortuosities(self):
-        tortuosities_generations = [(edge['tortuosity'], edge['generation']) for edge in self.dag.edges]
-        tortuosities_generations = list(filter(lambda x: x[1] <= self.max_gen, tortuosities_generations))
-        tortuosities, generations, tortuosities_per_gen = self.stats_per_gen(tortuosities_generations)
-
-        plt.title('segments tortuosisities count')
-        plt.hist(tortuosities, bins=8)
-        plt.xlabel('tortuosities segments')
-        plt.ylabel('count')
-        plt.savefig(f"results/{self.dag_id}_tortuosities")
-        plt.clf()
-
-        plt.title('segments tortuosities per generation')
-        plt.boxplot(tortuosities_per_gen)
-        plt.xlabel('generation')
-        plt.ylabel('tortuosities segments')
-        plt.savefig(f"results/{self.dag_id}_tortuosities_per_generation")
-        plt.clf()
+        return self.metric_summary('tortuosity')
 
     def interstitial_distances(self):
-        int_dist_generations = [(edge['interstitial_distance'], edge['generation']) for edge in self.dag.edges]
-        int_dist_generations = list(filter(lambda x: x[1] <= self.max_gen, int_dist_generations))
-        int_distances, generations, int_dist_per_gen = self.stats_per_gen(int_dist_generations)
-
-        plt.title('interstitial distances')
-        plt.hist(int_distances, bins=8)
-        plt.xlabel('interstitial distance')
-        plt.ylabel('count')
-        plt.savefig(f"results/{self.dag_id}_interstitial_distance")
-        plt.clf()
-
-        plt.title('interstitial distances per generation')
-        plt.boxplot(int_dist_per_gen)
-        plt.xlabel('generation')
-        plt.ylabel('interstitial distance')
-        plt.savefig(f"results/{self.dag_id}_interstitial_distance_per_generation")
-        plt.clf()
-    
+        return self.metric_summary('interstitial_distance')
+
+    def values_per_gen(self, name):
+        # values of a metric in generations 1..the last one present, like the boxplots expect
+        metrics = self.metrics()[['generation', name]].dropna()
+        last_generation = int(metrics['generation'].max()) if len(metrics) > 0 else 0
+        return [metrics[name].values[metrics['generation'].values == generation]
+                for generation in range(1, last_generation + 1)]
+
+    def figures(self):
+        # descriptions of all figures for render_figure, plain data only so they can be sent to other processes
+        metrics = self.metrics()
+        figures = []
+        for name, suffix, title, x_label, bins, per_gen_title, per_gen_label in METRIC_FIGURES:
+            if name not in metrics:
+                continue
+            path = f"results/{self.dag_id}_{suffix}"
+            figures.append(('hist', path, title, metrics[name].dropna().values, x_label, 'count', {'bins': bins}))
+            figures.append(('boxplot', f"{path}_per_generation", per_gen_title, self.values_per_gen(name),
+                'generation', per_gen_label, {}))
+            if name == 'length':
+                edges_per_gen = [len(lengths) for lengths in self.values_per_gen(name)]
+                figures.append(('boxplot', f"results/{self.dag_id}_edges_per_generation", 'edges per generation',
+                    edges_per_gen, 'generation', 'edges count', {}))
+        return figures
+
+    def render(self, pool=None):
+        # without a pool figures are drawn here, with a multiprocessing pool an AsyncResult of the drawing is returned
+        if pool is not None:
+            return pool.map_async(render_figure, self.figures())
+        for figure in self.figures():
+            render_figure(figure)
+
     def save_graph_stats_to_csv(self):
         header = [
             'number_of_vessels',
             'vessel_total_length',
             'vessel_avg_length',
             'vascular_structure_volume',
+            'mean_interstitial_distance',
             'vascular_network_projection_area',
             'projection_explant_area',
             'vascular_density',
@@ -157,6 +150,7 @@ class GraphStats:
             self.dag['vessel_total_length'],
             self.dag['vessel_avg_length'],
             self.dag['vascular_structure_volume'],
+            self.dag['mean_interstitial_distance'],
             self.dag['vascular_network_projection_area'],
             self.dag['projection_explant_area'],
             self.dag['vascular_density'],
@@ -0,0 +1,71 @@
+from collections import deque
+import numpy as np
+from src.volume_io import iter_slabs
+
+
+def summed_area_table(mask):
+    # table[i, j] = sum of mask[:i, :j], zero padded so every box sum is 4 lookups
+    table = np.zeros(tuple(s + 1 for s in mask.shape), dtype=np.int64)
+    table[(slice(1, None),) * mask.ndim] = mask
+    for axis in range(mask.ndim):
+        np.cumsum(table, axis=axis, out=table)
+    return table
+
+
+def dense_box_sizes(shape, max_size=None):
+    return np.arange(2, min(min(shape), max_size or min(shape)) + 1)
+
+
+def box_sums_2d(table, box_size, gliding=True):
+    # sums of all box_size x box_size boxes of the table's mask, non overlapping boxes only when not gliding
+    step = 1 if gliding else box_size
+    r = box_size
+    return (table[r::step, r::step] - table[:-r:step, r::step] - table[r::step, :-r:step] + table[:-r:step, :-r:step])
+
+
+def lacunarity_from_moments(count, total, squares_total):
+    if count == 0 or total == 0:
+        return 0.0
+    mean = total / count
+    return (squares_total / count) / mean**2
+
+
+def box_moments(sums):
+    sums = sums.astype(np.float64)
+    return sums.size, sums.sum(), np.square(sums).sum()
+
+
+def lacunarity_2d(mask, box_sizes, gliding=True):
+    table = summed_area_table(np.asarray(mask) > 0)
+    lacunarities = []
+    for box_size in box_sizes:
+        if box_size > min(mask.shape):
+            lacunarities.append(np.nan)
+            continue
+        lacunarities.append(lacunarity_from_moments(*box_moments(box_sums_2d(table, box_size, gliding))))
+    return np.array(lacunarities)
+
+
+def lacunarity_3d(volume, box_sizes, gliding=True, slab_size=32, bounds=None):
+    # streamed along the first axis - only summed area tables of the last max(box_sizes) planes are kept
+    box_sizes = [int(b) for b in box_sizes]
+    (z_min, y_min, x_min), (z_max, y_max, x_max) = bounds if bounds is not None else ((0, 0, 0), volume.shape)
+    moments = {box_size: np.zeros(3) for box_size in box_sizes}
+
+    plane_table = np.zeros((y_max - y_min + 1, x_max - x_min + 1), dtype=np.int64)
+    tables = deque([plane_table], maxlen=max(box_sizes) + 1)
+    depth = 0
+    for _, slab in iter_slabs(volume, slab_size, bounds):
+        for plane in slab:
+            plane_table = plane_table + summed_area_table(plane)
+            tables.append(plane_table)
+            depth += 1
+            for box_size in box_sizes:
+                # boxes ending at this plane, non overlapping ones only every box_size planes
+                if depth < box_size or box_size > min(plane_table.shape) - 1 or (not gliding and depth % box_size != 0):
+                    continue
+                box_table = plane_table - tables[-1 - box_size]
+                moments[box_size] += box_moments(box_sums_2d(box_table, box_size, gliding))
+
+    return np.array([lacunarity_from_moments(*moments[box_size]) if moments[box_size][0] > 0 else np.nan
+                     for box_size in box_sizes])
@@ -0,0 +1,120 @@
+import numpy as np
+from src.volume_io import iter_slabs
+
+
+def iter_slab_coords(volume, slab_size=32):
+    # coordinates of foreground voxels, one slab at a time
+    for start, slab in iter_slabs(volume, slab_size):
+        coords = np.argwhere(slab)
+        coords[:, 0] += start
+        yield coords
+
+
+def coords_moments(coords, shift):
+    shifted = coords - shift
+    return len(coords), shifted.sum(axis=0), shifted.T @ shifted
+
+
+def mean_and_covariance(count, total, outer, shift):
+    if count == 0:
+        raise ValueError('Can not project an empty set of voxels')
+    mean = total / count
+    return mean + shift, outer / count - np.outer(mean, mean)
+
+
+def volume_moments(volume, slab_size=32):
+    # mean and covariance of foreground voxel coordinates from chunked moment sums
+    shift = np.array(volume.shape) / 2
+    count, total, outer = 0, np.zeros(3), np.zeros((3, 3))
+    for coords in iter_slab_coords(volume, slab_size):
+        slab_count, slab_total, slab_outer = coords_moments(coords, shift)
+        count += slab_count
+        total += slab_total
+        outer += slab_outer
+    return (count,) + mean_and_covariance(count, total, outer, shift)
+
+
+def principal_axes(covariance):
+    # rows ordered by decreasing variance, each with its largest component positive
+    eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+    axes = eigenvectors[:, np.argsort(eigenvalues)[::-1]].T
+    signs = np.sign(axes[np.arange(len(axes)), np.argmax(np.abs(axes), axis=1)])
+    return axes * signs[:, np.newaxis]
+
+
+def project_points(points, mean, axes, components=2):
+    return (points - mean) @ axes[:components].T
+
+
+def orient_axes(axes, mins, maxs):
+    # orient axes like sklearn PCA does - the point farthest along an axis gets a positive coordinate
+    flip = np.abs(mins) > np.abs(maxs)
+    axes = axes.copy()
+    axes[:2][flip] *= -1
+    return axes, np.where(flip, -maxs, mins), np.where(flip, -mins, maxs)
+
+
+def projection_bounds(volume, mean, axes, slab_size=32):
+    mins, maxs = np.full(2, np.inf), np.full(2, -np.inf)
+    for coords in iter_slab_coords(volume, slab_size):
+        if len(coords) == 0:
+            continue
+        projection = project_points(coords, mean, axes)
+        mins = np.minimum(mins, projection.min(axis=0))
+        maxs = np.maximum(maxs, projection.max(axis=0))
+    return mins, maxs
+
+
+def projection_data(source, shape, voxel_count, mean, axes, mins, maxs):
+    # basis with its provenance, stored as dag['projection'] and shared by every 2d step
+    return {
+        'source': source,
+        'shape': np.array(shape, dtype=np.int64),
+        'voxel_count': int(voxel_count),
+        'mean': mean,
+        'axes': axes,
+        'mins': mins,
+        'maxs': maxs,
+    }
+
+
+def volume_projection(volume, slab_size=32):
+    # two streamed passes (moments, projection bounds), memory stays bounded by one slab
+    count, mean, covariance = volume_moments(volume, slab_size)
+    axes = principal_axes(covariance)
+    axes, mins, maxs = orient_axes(axes, *projection_bounds(volume, mean, axes, slab_size))
+    return projection_data('reconstruction', volume.shape, count, mean, axes, mins, maxs)
+
+
+def central_line_projection(dag):
+    coords = np.concatenate([dag.node_voxels, dag.edge_voxels]).astype(np.float64)
+    shift = np.array(dag.volume_shape) / 2
+    mean, covariance = mean_and_covariance(*coords_moments(coords, shift), shift)
+    axes = principal_axes(covariance)
+    projection = project_points(coords, mean, axes)
+    axes, mins, maxs = orient_axes(axes, projection.min(axis=0), projection.max(axis=0))
+    return projection_data('central_line', dag.volume_shape, len(coords), mean, axes, mins, maxs)
+
+
+def matches_projection(projection, source, shape, voxel_count):
+    return (projection is not None
+            and str(projection['source']) == source
+            and tuple(np.asarray(projection['shape'])) == tuple(shape)
+            and int(projection['voxel_count']) == int(voxel_count))
+
+
+def rasterise_projection(volume, projection, slab_size=32):
+    mins, maxs = projection['mins'], projection['maxs']
+    shape = (np.round(maxs) - mins).astype(np.int64) + 1
+    mask = np.zeros(shape, dtype=bool)
+    for coords in iter_slab_coords(volume, slab_size):
+        pixels = (np.round(project_points(coords, projection['mean'], projection['axes'])) - mins).astype(np.int64)
+        mask[pixels[:, 0], pixels[:, 1]] = True
+    return mask
+
+
+def set_voxels_2d(dag, projection):
+    # all node and edge voxels mapped with one batched transform each
+    mean, axes = projection['mean'], projection['axes']
+    dag.set_node_voxel_column('voxels2d', project_points(dag.node_voxels, mean, axes))
+    dag.set_edge_voxel_column('voxels2d', project_points(dag.edge_voxels, mean, axes))
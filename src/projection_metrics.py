@@ -0,0 +1,41 @@
+import numpy as np
+from scipy.ndimage import binary_erosion
+
+CONTOUR_STRUCTURE = np.ones((3, 3), dtype=bool)
+
+
+def projection_contour(mask):
+    # foreground pixels with at least one of 8 neighbours in background (outside of the mask counts as background)
+    mask = np.asarray(mask, dtype=bool)
+    return mask & ~binary_erosion(mask, CONTOUR_STRUCTURE, border_value=0)
+
+
+def default_box_sizes(shape):
+    return 2 ** np.arange(int(np.log2(min(shape))))
+
+
+def box_counts(mask, box_sizes):
+    mask = np.asarray(mask, dtype=bool)
+    counts = []
+    for box_size in box_sizes:
+        padded_shape = [-(-s // box_size) * box_size for s in mask.shape]
+        padded = np.zeros(padded_shape, dtype=bool)
+        padded[:mask.shape[0], :mask.shape[1]] = mask
+        boxes = padded.reshape(padded_shape[0] // box_size, box_size, padded_shape[1] // box_size, box_size)
+        counts.append(np.count_nonzero(boxes.any(axis=(1, 3))))
+    return np.array(counts)
+
+
+def box_counting_fit(mask, box_sizes=None):
+    # line fitted to log(number of occupied boxes) against log(1 / box size), its slope is the dimension
+    box_sizes = default_box_sizes(mask.shape) if box_sizes is None else np.asarray(box_sizes)
+    counts = box_counts(mask, box_sizes)
+    occupied = counts > 0
+    if np.count_nonzero(occupied) < 2:
+        return {'box_sizes': box_sizes, 'counts': counts, 'dimension': np.nan, 'intercept': np.nan}
+    slope, intercept = np.polyfit(np.log(1 / box_sizes[occupied]), np.log(counts[occupied]), 1)
+    return {'box_sizes': box_sizes, 'counts': counts, 'dimension': slope, 'intercept': intercept}
+
+
+def box_counting_dimension(mask, box_sizes=None):
+    return box_counting_fit(mask, box_sizes)['dimension']
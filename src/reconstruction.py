@@ -0,0 +1,53 @@
+from functools import lru_cache
+import numpy as np
+from scipy import fft
+from skimage import morphology
+from src.tiling import map_tiles
+
+
+@lru_cache(maxsize=32)
+def ball_spectrum(radius, shape, workers=None):
+    # rfft of morphology.ball centred at the origin of a periodic volume, so a product with a spectrum is a 'same' convolution
+    kernel = np.zeros(shape, dtype=np.float32)
+    size = 2 * radius + 1
+    kernel[:size, :size, :size] = morphology.ball(radius)
+    kernel = np.roll(kernel, (-radius, -radius, -radius), axis=(0, 1, 2))
+    return fft.rfftn(kernel, workers=workers)
+
+
+def tiles_fft_shape(shape, tile_size, halo):
+    # one fft shape for all tiles (the cached kernel spectra are shared), cores plus halo on both sides
+    return tuple(fft.next_fast_len(min(tile_size, s) + 2 * halo, real=True) for s in shape)
+
+
+def fill_iteration(mask, kernel_sizes, fill_threshold, tile_size=128, workers=None, output=None):
+    # one reconstruction iteration: every ball radius is tested against the same mask, transformed once per tile
+    halo = max(kernel_sizes)
+    fft_shape = tiles_fft_shape(mask.shape, tile_size, halo)
+
+    def fill_tile(crop, core):
+        spectrum = fft.rfftn(crop, workers=workers)
+        kernel_size_map = np.zeros(crop[core].shape, dtype=np.uint8)
+        for kernel_size in kernel_sizes:
+            counts = fft.irfftn(spectrum * ball_spectrum(kernel_size, fft_shape, workers), s=fft_shape, workers=workers)[core]
+            fill_percentage = np.rint(counts) / np.sum(morphology.ball(kernel_size))
+            kernel_size_map[fill_percentage > fill_threshold] = kernel_size + 1
+        return kernel_size_map
+
+    # tiles with empty crops have all fill percentages zero and are skipped
+    output = np.zeros(mask.shape, dtype=np.uint8) if output is None else output
+    return map_tiles(fill_tile, mask, np.array(fft_shape) - 2 * halo, halo, output, crop_shape=fft_shape, dtype=np.float32)
+
+
+def calculate_reconstruction(mask, kernel_sizes=[10, 9, 8], fill_threshold=0.5, iters=1, tile_size=128, workers=None):
+    # kernel size maps of consecutive iterations, voxels filled by any ball joining the mask for the next one
+    kernel_sizes_maps = []
+    mask = np.asarray(mask) > 0
+
+    for i in range(iters):
+        kernel_size_map = fill_iteration(mask, kernel_sizes, fill_threshold, tile_size, workers)
+        mask |= kernel_size_map > 0
+        kernel_sizes_maps.append(kernel_size_map)
+        print(f'Iteration {i + 1} ended successfully')
+
+    return kernel_sizes_maps
@@ -0,0 +1,51 @@
+import numpy as np
+from scipy import ndimage
+from skimage import measure
+from src.tiling import label_tiles
+
+
+def label_regions(binary_mask, connectivity=3, tile_shape=None):
+    if tile_shape is None:
+        return measure.label(binary_mask, connectivity=connectivity)
+    return label_tiles(binary_mask, tile_shape, connectivity)
+
+
+def region_sizes(labeled):
+    return np.bincount(np.asarray(labeled).ravel())
+
+
+def bounding_box(slices):
+    # regionprops bbox of a find_objects slice tuple: (min coords..., max coords...)
+    return tuple(s.start for s in slices) + tuple(s.stop for s in slices)
+
+
+def filter_regions(labeled, min_size, inclusive=True):
+    # mask of regions with at least (or, not inclusive, more than) min_size voxels, built with one lookup pass;
+    # labels, sizes and bounding boxes of the kept regions are returned alongside
+    sizes = region_sizes(labeled)
+    keep = sizes >= min_size if inclusive else sizes > min_size
+    keep[0] = False
+    kept_labels = np.flatnonzero(keep)
+
+    objects = ndimage.find_objects(labeled, max_label=kept_labels[-1] if len(kept_labels) else 0)
+    bounding_boxes = [bounding_box(objects[label - 1]) for label in kept_labels]
+    return keep[labeled], kept_labels, sizes[kept_labels], bounding_boxes
+
+
+def get_main_regions(binary_mask, min_size=10_000, connectivity=3, tile_shape=None):
+    # regions of at least min_size voxels, cropped to the box containing all of them
+    labeled = label_regions(binary_mask, connectivity, tile_shape)
+    main_regions, _, _, bounding_boxes = filter_regions(labeled, min_size)
+    if len(bounding_boxes) == 0:
+        raise ValueError(f'No region has at least {min_size} voxels')
+
+    lower_bounds = np.min(bounding_boxes, axis=0)[:3]
+    upper_bounds = np.max(bounding_boxes, axis=0)[3:]
+    return main_regions[tuple(slice(a, b) for a, b in zip(lower_bounds, upper_bounds))], bounding_boxes
+
+
+def get_largest_regions(binary_mask, min_size=1000, connectivity=3, tile_shape=None):
+    labeled = label_regions(binary_mask, connectivity, tile_shape)
+    largest_regions, kept_labels, _, _ = filter_regions(labeled, min_size, inclusive=False)
+    print(f"found {len(kept_labels)} main regions, out of {np.max(labeled)} regions")
+    return largest_regions.astype(np.uint8)
@@ -0,0 +1,119 @@
+import numpy as np
+
+NEIGHBOUR_OFFSETS = np.array([
+    (dx, dy, dz) for dx in [-1, 0, 1] for dy in [-1, 0, 1] for dz in [-1, 0, 1] if not dx == dy == dz == 0])
+
+
+class NeighbourTable:
+    # 26-neighbourhood of every voxel of a sparse voxel set, found with searchsorted on sorted linear indices
+    def __init__(self, coords, shape):
+        self.shape = tuple(int(s) for s in shape)
+        # linear indices in a volume padded by 1, so neighbours of border voxels never wrap around
+        self.padded_shape = tuple(s + 2 for s in self.shape)
+        keys = self.linear_indices(coords)
+        order = np.argsort(keys, kind='stable')
+        self.coords = np.asarray(coords, dtype=np.int64)[order].reshape(-1, 3)
+        self.keys = keys[order]
+
+        offsets = np.ravel_multi_index((NEIGHBOUR_OFFSETS + 1).T, self.padded_shape) - np.ravel_multi_index((1, 1, 1), self.padded_shape)
+        self.neighbours = self.find(self.keys[:, np.newaxis] + offsets[np.newaxis, :])
+
+    @staticmethod
+    def from_volume(volume):
+        coords = np.unravel_index(np.flatnonzero(volume), volume.shape)
+        return NeighbourTable(np.column_stack(coords), volume.shape)
+
+    def __len__(self):
+        return len(self.coords)
+
+    def linear_indices(self, coords):
+        coords = np.asarray(coords, dtype=np.int64).reshape(-1, 3)
+        return np.ravel_multi_index((coords + 1).T, self.padded_shape)
+
+    def find(self, keys):
+        # positions of voxels with given linear indices, -1 where there is no such voxel
+        if len(self.keys) == 0:
+            return np.full(np.shape(keys), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[positions] == keys, positions, -1)
+
+    def index_of(self, coords):
+        return self.find(self.linear_indices(coords))
+
+    def neighbour_counts(self, alive=None, voxels=None):
+        neighbours = self.neighbours if voxels is None else self.neighbours[voxels]
+        present = neighbours >= 0
+        if alive is not None:
+            present &= alive[np.maximum(neighbours, 0)]
+        return np.count_nonzero(present, axis=1)
+
+    def to_volume(self, selected=None, dtype=np.uint8):
+        volume = np.zeros(self.shape, dtype=dtype)
+        coords = self.coords if selected is None else self.coords[selected]
+        volume[tuple(coords.T)] = 1
+        return volume
+
+
+def trim_leaves(table, iters=1):
+    # removes voxels with less than 2 neighbours, iters times - only neighbours of removed voxels are checked again
+    alive = np.ones(len(table), dtype=bool)
+    candidates = np.arange(len(table))
+    for _ in range(iters):
+        if len(candidates) == 0:
+            break
+        removed = candidates[table.neighbour_counts(alive, candidates) < 2]
+        alive[removed] = False
+        neighbours = table.neighbours[removed].ravel()
+        candidates = np.unique(neighbours[neighbours >= 0])
+        candidates = candidates[alive[candidates]]
+    return alive
+
+
+def propagate_values(table, sources, values):
+    # breadth first search from all sources at once, every reached voxel takes the value of the voxel it was first
+    # reached from (sources in given order, neighbours in NEIGHBOUR_OFFSETS order, like a FIFO queue would);
+    # returns values of all table voxels and which of them were reached
+    result = np.zeros(len(table), dtype=np.asarray(values).dtype)
+    reached = np.zeros(len(table), dtype=bool)
+    frontier = np.asarray(sources, dtype=np.int64)
+    result[frontier] = values
+    reached[frontier] = True
+    while len(frontier) > 0:
+        candidates = table.neighbours[frontier].ravel()
+        found = np.flatnonzero(candidates >= 0)
+        found = found[~reached[candidates[found]]]
+        # first discovery of every voxel, in discovery order
+        _, first = np.unique(candidates[found], return_index=True)
+        found = found[np.sort(first)]
+        result[candidates[found]] = result[frontier[found // len(NEIGHBOUR_OFFSETS)]]
+        frontier = candidates[found]
+        reached[frontier] = True
+    return result, reached
+
+
+def leaves_mask(table):
+    return table.neighbour_counts() <= 1
+
+
+def bifurcations_mask(table):
+    return table.neighbour_counts() > 2
+
+
+def trim_skeleton(skeleton, iters=1, table=None):
+    table = NeighbourTable.from_volume(skeleton) if table is None else table
+    return table.to_volume(trim_leaves(table, iters))
+
+
+def mark_leaves(skeleton, table=None):
+    table = NeighbourTable.from_volume(skeleton) if table is None else table
+    return table.to_volume(leaves_mask(table))
+
+
+def mark_bifurcation_regions(skeleton, table=None):
+    table = NeighbourTable.from_volume(skeleton) if table is None else table
+    return table.to_volume(bifurcations_mask(table))
+
+
+def mark_nodes(skeleton, table=None):
+    table = NeighbourTable.from_volume(skeleton) if table is None else table
+    return table.to_volume(leaves_mask(table) | bifurcations_mask(table))
@@ -0,0 +1,50 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class EdgeSpatialIndex:
+    # KD-tree over edge centroids (or all centre-line voxels of the edges) answering
+    # "nearest vessel that is neither the edge itself, its ancestor nor its descendant" queries
+    def __init__(self, dag, use_voxels=False):
+        preorder = dag.edge_preorder()
+        self.enter = np.empty(dag.number_of_edges, dtype=np.int64)
+        self.enter[preorder] = np.arange(dag.number_of_edges)
+        self.exit = self.enter + dag.subtree_sizes()
+
+        if use_voxels:
+            self.points = dag.edge_voxels.astype(np.float64)
+            self.point_edges = np.repeat(np.arange(dag.number_of_edges), dag.edge_voxel_counts())
+        else:
+            self.points = np.asarray(dag.edge_columns['centroid'], dtype=np.float64)
+            self.point_edges = np.arange(dag.number_of_edges)
+        self.tree = cKDTree(self.points)
+
+    def is_lineage(self, edges_a, edges_b):
+        enter_a, enter_b = self.enter[edges_a], self.enter[edges_b]
+        a_above_b = (enter_a <= enter_b) & (enter_b < self.exit[edges_a])
+        b_above_a = (enter_b <= enter_a) & (enter_a < self.exit[edges_b])
+        return a_above_b | b_above_a
+
+    def nearest_unrelated_distances(self, query_points, query_edges, k=8):
+        # NaN for queries without any unrelated point, like other metrics that can not be measured
+        query_points = np.asarray(query_points, dtype=np.float64)
+        distances = np.full(len(query_points), np.nan)
+        pending = np.arange(len(query_points))
+
+        # neighbourhoods are doubled only for queries whose k nearest points all belong to their lineage
+        while len(pending) > 0:
+            k = min(k, len(self.points))
+            neighbour_distances, neighbours = self.tree.query(query_points[pending], k=k)
+            neighbour_distances = neighbour_distances.reshape(len(pending), k)
+            neighbour_edges = self.point_edges[neighbours.reshape(len(pending), k)]
+
+            related = self.is_lineage(query_edges[pending][:, np.newaxis], neighbour_edges)
+            nearest = np.where(related, np.inf, neighbour_distances).min(axis=1)
+            found = np.isfinite(nearest)
+            distances[pending[found]] = nearest[found]
+
+            if k == len(self.points):
+                break
+            pending = pending[~found]
+            k *= 2
+        return distances
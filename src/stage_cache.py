@@ -0,0 +1,106 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+CACHE_VERSION = 3
+
+
+def _update_hash(hash_, value):
+    if isinstance(value, np.ndarray):
+        hash_.update(f'{value.dtype}{value.shape}'.encode())
+        hash_.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        hash_.update(b'[')
+        for v in value:
+            _update_hash(hash_, v)
+            hash_.update(b',')
+        hash_.update(b']')
+    elif isinstance(value, dict):
+        _update_hash(hash_, sorted(value.items()))
+    else:
+        hash_.update(repr(value).encode())
+
+
+class StageCache:
+    # outputs of pipeline stages stored on disk under a hash of the stage inputs, least recently used evicted first
+    def __init__(self, directory, max_bytes=4 * 1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def file_hash(self, filename, chunk_size=1 << 24):
+        # content hash, recomputed only when the size or modification time of the file changes
+        # each input has its own small record replaced atomically, so pool workers hashing different inputs
+        # do not overwrite each other's records
+        stat = os.stat(filename)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        record_path = self.file_hash_path(filename)
+        try:
+            with open(record_path) as f:
+                known = json.load(f)
+            if known[0] == signature:
+                return known[1]
+        except (OSError, ValueError, IndexError):
+            pass
+
+        hash_ = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                hash_.update(chunk)
+        temporary_path = f'{record_path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump([signature, hash_.hexdigest()], f)
+        os.replace(temporary_path, record_path)
+        return hash_.hexdigest()
+
+    def file_hash_path(self, filename):
+        name = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()
+        return os.path.join(self.directory, f'file-{name}.json')
+
+    def key(self, stage, inputs):
+        hash_ = hashlib.sha1()
+        _update_hash(hash_, [CACHE_VERSION, stage, inputs])
+        return f'{stage}-{hash_.hexdigest()}'
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def load(self, key):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as archive:
+                outputs = {name: archive[name] for name in archive.files}
+        except (OSError, ValueError):
+            return None
+        os.utime(path)
+        return outputs
+
+    def store(self, key, outputs):
+        path = self.path(key)
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as f:
+            np.savez(f, **outputs)
+        os.replace(temporary_path, path)
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort()
+        total = sum(e[1] for e in entries)
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                os.remove(os.path.join(self.directory, name))
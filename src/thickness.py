@@ -0,0 +1,126 @@
+import numpy as np
+from scipy import ndimage
+from scipy.signal import fftconvolve
+from skimage import morphology
+from src.skeleton_topology import NeighbourTable, propagate_values
+from src.tiling import read_block
+
+# a ball sum gathered per voxel costs about this many times less than one voxel of an fft convolution
+FFT_COST_PER_VOXEL = 16
+GATHER_CHUNK_SIZE = 2 ** 24
+
+
+def _block_groups(coords, block_size):
+    # indices of voxels grouped by block_size cubes, so crops around a group cover only occupied parts of the volume
+    blocks = coords // block_size
+    blocks = np.ravel_multi_index(blocks.T, tuple(blocks.max(axis=0) + 1)) if len(coords) else blocks[:, 0]
+    order = np.argsort(blocks, kind='stable')
+    return np.split(order, np.flatnonzero(np.diff(blocks[order])) + 1)
+
+
+def distance_radii(reconstruction, coords, max_radius, block_size=32, halo=8):
+    # ceil of the distance to the nearest background voxel - one more than the radius of the largest ball
+    # (morphology.ball) lying inside the reconstruction, capped at max_radius + 1
+    cap = max_radius + 1
+    radii = np.full(len(coords), cap, dtype=np.int32)
+    pending = np.arange(len(coords))
+    # crops with a small halo first, voxels further than halo from the background are retried with a doubled one
+    while len(pending) > 0:
+        halo = min(halo, cap)
+        unresolved = []
+        for group in _block_groups(coords[pending], block_size):
+            group = pending[group]
+            start = coords[group].min(axis=0) - halo
+            stop = coords[group].max(axis=0) + halo + 1
+            # background shell around the crop, further than halo from every voxel of the group
+            crop = np.pad(read_block(reconstruction, start, stop), 1)
+            distances = ndimage.distance_transform_edt(crop)[tuple((coords[group] - start + 1).T)]
+            resolved = (distances <= halo) | (halo == cap)
+            radii[group[resolved]] = np.minimum(np.ceil(distances[resolved]), cap)
+            unresolved.append(group[~resolved])
+        pending = np.concatenate(unresolved) if unresolved else pending[:0]
+        halo *= 2
+    return radii
+
+
+def ball_sums(reconstruction, coords, kernel, block_size=32):
+    # number of reconstruction voxels inside the kernel centred at every voxel, per block either gathered
+    # directly or taken from an fft convolution of the block crop, whichever is cheaper
+    radius = kernel.shape[0] // 2
+    kernel_offsets = np.argwhere(kernel) - radius
+    sums = np.zeros(len(coords), dtype=np.int64)
+    for group in _block_groups(coords, block_size):
+        start = coords[group].min(axis=0) - radius
+        stop = coords[group].max(axis=0) + radius + 1
+        crop = read_block(reconstruction, start, stop)
+        local = coords[group] - start
+
+        if len(group) * len(kernel_offsets) < FFT_COST_PER_VOXEL * crop.size:
+            strides = np.array([crop.shape[1] * crop.shape[2], crop.shape[2], 1])
+            flat_voxels = local @ strides
+            flat_offsets = kernel_offsets @ strides
+            flat_crop = crop.ravel()
+            chunk = max(1, GATHER_CHUNK_SIZE // len(flat_offsets))
+            for i in range(0, len(group), chunk):
+                gathered = flat_crop[flat_voxels[i:i + chunk, np.newaxis] + flat_offsets[np.newaxis, :]]
+                sums[group[i:i + chunk]] = np.count_nonzero(gathered, axis=1)
+        else:
+            convolved = fftconvolve(crop.astype(np.float64), kernel.astype(np.float64), mode='valid')
+            sums[group] = np.rint(convolved[tuple((local - radius).T)])
+    return sums
+
+
+def fill_fraction_radii(reconstruction, coords, kernel_sizes, fill_threshold, block_size=32):
+    # kernel radius + 1 of the last ball (tried in increasing order) filled by the reconstruction in more than
+    # fill_threshold, like calculate_skeleton_thickness - only voxels still growing are tested for each radius
+    kernel_sizes = sorted(kernel_sizes)
+    radii = np.zeros(len(coords), dtype=np.int32)
+    if len(coords) == 0 or len(kernel_sizes) == 0:
+        return radii
+
+    # balls smaller than the distance to the background are filled completely, no need to test them
+    if fill_threshold < 1:
+        filled_radii = distance_radii(reconstruction, coords, kernel_sizes[-1], block_size)
+    else:
+        filled_radii = np.zeros(len(coords), dtype=np.int32)
+
+    growing = np.ones(len(coords), dtype=bool)
+    for kernel_radius in kernel_sizes:
+        filled = growing & (kernel_radius < filled_radii)
+        radii[filled] = kernel_radius + 1
+
+        tested = np.flatnonzero(growing & ~filled)
+        if len(tested) == 0:
+            continue
+        kernel = morphology.ball(kernel_radius)
+        fill_factors = ball_sums(reconstruction, coords[tested], kernel, block_size) / np.sum(kernel)
+        passed = fill_factors > fill_threshold
+        radii[tested[passed]] = kernel_radius + 1
+        growing[tested[~passed]] = False
+    return radii
+
+
+def calculate_skeleton_thickness(skeleton, reconstruction, kernel_sizes=range(70), fill_threshold=None, block_size=32):
+    # thickness map of skeleton voxels, from the distance transform or, given fill_threshold, from ball fill fractions
+    coords = np.column_stack(np.unravel_index(np.flatnonzero(skeleton), skeleton.shape))
+    if fill_threshold is None:
+        radii = distance_radii(reconstruction, coords, max(kernel_sizes), block_size)
+    else:
+        radii = fill_fraction_radii(reconstruction, coords, kernel_sizes, fill_threshold, block_size)
+
+    thickness = np.zeros(skeleton.shape, dtype=np.int32)
+    thickness[tuple(coords.T)] = radii
+    return thickness
+
+
+def propagate_thickness_to_trims(trimmed_skeleton, skeleton, skeleton_thickness, table=None):
+    # thickness of the trimmed skeleton spread to the trimmed ends by propagate_values, skeleton voxels not connected
+    # to the trimmed skeleton get 0; volumes are only read at skeleton voxels and the output is the only new volume
+    table = NeighbourTable.from_volume(skeleton) if table is None else table
+    coords = tuple(table.coords.T)
+    sources = np.flatnonzero(np.asarray(trimmed_skeleton[coords]) > 0)
+    radii, _ = propagate_values(table, sources, np.asarray(skeleton_thickness[coords], dtype=np.int32)[sources])
+
+    thickness = np.zeros(table.shape, dtype=np.int32)
+    thickness[coords] = radii
+    return thickness
@@ -0,0 +1,188 @@
+import itertools
+import tempfile
+import numpy as np
+from scipy import ndimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from skimage import measure
+
+
+class Tile:
+    # core block of a volume and its crop extended by halo on every side (partly outside of the volume at borders)
+    def __init__(self, start, stop, halo):
+        self.start = np.asarray(start)
+        self.stop = np.asarray(stop)
+        self.halo = halo
+
+    @property
+    def core(self):
+        return tuple(slice(a, b) for a, b in zip(self.start, self.stop))
+
+    @property
+    def crop_start(self):
+        return self.start - self.halo
+
+    @property
+    def crop_stop(self):
+        return self.stop + self.halo
+
+    @property
+    def core_in_crop(self):
+        return tuple(slice(self.halo, self.halo + b - a) for a, b in zip(self.start, self.stop))
+
+
+def iter_tiles(shape, tile_shape, halo=0):
+    tile_shape = np.broadcast_to(tile_shape, len(shape))
+    for start in itertools.product(*(range(0, s, t) for s, t in zip(shape, tile_shape))):
+        yield Tile(start, np.minimum(np.add(start, tile_shape), shape), halo)
+
+
+def read_block(volume, start, stop, dtype=bool):
+    # volume[start:stop] (numpy, memmap or packed volume), zeros outside of the volume
+    block = np.zeros(tuple(np.subtract(stop, start)), dtype=dtype)
+    clipped_start = np.maximum(start, 0)
+    clipped_stop = np.minimum(stop, volume.shape)
+    if np.any(clipped_stop <= clipped_start):
+        return block
+    region = np.asarray(volume[tuple(slice(a, b) for a, b in zip(clipped_start, clipped_stop))])
+    block[tuple(slice(a - s, b - s) for a, b, s in zip(clipped_start, clipped_stop, start))] = region > 0 if dtype == bool else region
+    return block
+
+
+def map_tiles(function, volume, tile_shape, halo, output, crop_shape=None, dtype=bool, skip_empty=True):
+    # output[core] = function(crop, core_in_crop) for every tile, crops read one at a time (output may be a memmap);
+    # with crop_shape all crops have that shape, so per shape caches of the function are shared by all tiles
+    for tile in iter_tiles(volume.shape, tile_shape, halo):
+        crop_stop = tile.crop_stop if crop_shape is None else tile.crop_start + crop_shape
+        crop = read_block(volume, tile.crop_start, crop_stop, dtype)
+        if skip_empty and not crop.any():
+            continue
+        output[tile.core] = function(crop, tile.core_in_crop)
+    return output
+
+
+def _lower_envelope(f):
+    # min over q of f[q] + (p - q)^2 for every p along the first axis, the lower envelope of parabolas
+    # (Felzenszwalb and Huttenlocher) built for all columns of f at once
+    n, m = f.shape
+    columns = np.arange(m)
+    heights = f + np.arange(n, dtype=np.float64)[:, np.newaxis] ** 2
+    vertices = np.zeros((n, m), dtype=np.int64)
+    bounds = np.full((n + 1, m), np.inf)
+    bounds[0] = -np.inf
+    k = np.zeros(m, dtype=np.int64)
+    crossings = np.empty(m)
+    for q in range(1, n):
+        # parabolas hidden by the one at q are popped, a column at a time until none is left to pop
+        todo = columns
+        while len(todo) > 0:
+            v = vertices[k[todo], todo]
+            crossing = (heights[q, todo] - heights[v, todo]) / (2 * (q - v))
+            crossings[todo] = crossing
+            hidden = crossing <= bounds[k[todo], todo]
+            todo = todo[hidden]
+            k[todo] -= 1
+        k += 1
+        vertices[k, columns] = q
+        bounds[k, columns] = crossings
+        bounds[k + 1, columns] = np.inf
+
+    result = np.empty((n, m))
+    k[:] = 0
+    for p in range(n):
+        todo = columns
+        while len(todo) > 0:
+            todo = todo[bounds[k[todo] + 1, todo] < p]
+            k[todo] += 1
+        v = vertices[k, columns]
+        result[p] = (p - v) ** 2 + f[v, columns]
+    return result
+
+
+def mean_distance_to_foreground(volume, start, stop, max_voxels=2**26, slab_voxels=2**22):
+    # mean distance from the background voxels of volume[start:stop] to its nearest foreground voxel. Boxes up to
+    # max_voxels take one distance_transform_edt (about 21 bytes per voxel), larger ones the same transform split
+    # by axes: distances along the first axis from two sweeps over the slabs, kept on disk as uint16, then the
+    # lower envelopes along the other two axes slab by slab, so memory holds only slabs of slab_voxels voxels
+    start, stop = np.asarray(start), np.asarray(stop)
+    shape = tuple(stop - start)
+    if np.prod(shape) <= max_voxels:
+        background = ~read_block(volume, start, stop)
+        distances = ndimage.distance_transform_edt(background)[background]
+        return distances.mean() if len(distances) > 0 else 0.0
+
+    # the first axis distance of columns without foreground stays at the uint16 maximum, its square is larger
+    # than any distance within the box so these columns never give the nearest foreground
+    far = np.iinfo(np.uint16).max
+    axis_distances = np.memmap(tempfile.TemporaryFile(), dtype=np.uint16, mode='w+', shape=shape)
+    slab_size = max(1, slab_voxels // (shape[1] * shape[2]))
+    slabs = [(a, min(a + slab_size, shape[0])) for a in range(0, shape[0], slab_size)]
+    previous = np.full(shape[1:], -far, dtype=np.int64)
+    for a, b in slabs:
+        foreground = read_block(volume, (start[0] + a,) + tuple(start[1:]), (start[0] + b,) + tuple(stop[1:]))
+        for i in range(b - a):
+            previous[foreground[i]] = a + i
+            axis_distances[a + i] = np.minimum(a + i - previous, far)
+    following = np.full(shape[1:], 2 * far, dtype=np.int64)
+    for a, b in reversed(slabs):
+        foreground = read_block(volume, (start[0] + a,) + tuple(start[1:]), (start[0] + b,) + tuple(stop[1:]))
+        for i in reversed(range(b - a)):
+            following[foreground[i]] = a + i
+            axis_distances[a + i] = np.minimum(axis_distances[a + i], np.minimum(following - a - i, far))
+
+    total, count = 0.0, 0
+    for a, b in slabs:
+        squared = np.asarray(axis_distances[a:b], dtype=np.float64) ** 2
+        # envelope along the second axis, columns of all planes of the slab side by side, then along the third
+        squared = _lower_envelope(squared.transpose(1, 0, 2).reshape(shape[1], -1))
+        squared = squared.reshape(shape[1], b - a, shape[2]).transpose(2, 1, 0).reshape(shape[2], -1)
+        distances = np.sqrt(_lower_envelope(squared))
+        total += distances.sum()
+        count += np.count_nonzero(distances)
+    return total / count if count > 0 else 0.0
+
+
+def label_tiles(mask, tile_shape=256, connectivity=3, output=None):
+    # measure.label of a volume labelled tile by tile: components split by tile seams are joined with union-find
+    # over pairs of labels facing each other across seams, then relabelled in raster order like measure.label
+    labels = np.zeros(mask.shape, dtype=np.int32) if output is None else output
+    first_voxels = [np.zeros(0, dtype=np.int64)]
+    number_of_labels = 0
+    for tile in iter_tiles(mask.shape, tile_shape):
+        tile_labels, count = measure.label(read_block(mask, tile.start, tile.stop), connectivity=connectivity, return_num=True)
+        # first voxel of every tile label (raster order inside a tile is the global one), they order the final labels
+        voxels = np.flatnonzero(tile_labels)
+        _, first = np.unique(tile_labels.ravel()[voxels], return_index=True)
+        first_coords = np.unravel_index(voxels[first], tile_labels.shape)
+        first_voxels.append(np.ravel_multi_index(tuple(c + s for c, s in zip(first_coords, tile.start)), mask.shape))
+        labels[tile.core] = np.where(tile_labels > 0, tile_labels + number_of_labels, 0)
+        number_of_labels += count
+
+    pairs = [np.zeros((0, 2), dtype=np.int64)]
+    in_plane_offsets = [(dy, dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1) if abs(dy) + abs(dx) < connectivity]
+    for axis in range(3):
+        step = np.broadcast_to(tile_shape, 3)[axis]
+        for seam in range(step, mask.shape[axis], step):
+            before = np.asarray(labels[(slice(None),) * axis + (seam - 1,)])
+            after = np.asarray(labels[(slice(None),) * axis + (seam,)])
+            for dy, dx in in_plane_offsets:
+                a = before[max(dy, 0):before.shape[0] + min(dy, 0), max(dx, 0):before.shape[1] + min(dx, 0)]
+                b = after[max(-dy, 0):after.shape[0] + min(-dy, 0), max(-dx, 0):after.shape[1] + min(-dx, 0)]
+                touching = (a > 0) & (b > 0)
+                pairs.append(np.unique(np.stack([a[touching], b[touching]], axis=1), axis=0))
+
+    pairs = np.concatenate(pairs).astype(np.int64) - 1
+    adjacency = coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])), shape=(number_of_labels, number_of_labels))
+    _, components = connected_components(adjacency, directed=False)
+
+    # components numbered by their first voxel in raster order
+    first_voxels = np.concatenate(first_voxels)
+    component_first = np.full(components.max() + 1 if number_of_labels else 0, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(component_first, components, first_voxels)
+    rank = np.empty(len(component_first), dtype=np.int32)
+    rank[np.argsort(component_first)] = np.arange(1, len(component_first) + 1)
+    lookup = np.concatenate([[0], rank[components]]).astype(np.int32)
+
+    for tile in iter_tiles(mask.shape, tile_shape):
+        labels[tile.core] = lookup[labels[tile.core]]
+    return labels
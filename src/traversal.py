@@ -0,0 +1,111 @@
+import numpy as np
+
+
+####################################################################################
+#                                 OBJECT GRAPHS                                    #
+####################################################################################
+
+def iter_nodes_preorder(root):
+    stack = [root]
+    while len(stack) > 0:
+        node = stack.pop()
+        yield node
+        stack.extend(e.node_b for e in reversed(node.edges))
+
+
+def iter_edges_preorder(root):
+    stack = list(reversed(root.edges))
+    while len(stack) > 0:
+        edge = stack.pop()
+        yield edge
+        stack.extend(reversed(edge.node_b.edges))
+
+
+def iter_edges_postorder(root):
+    # children edges are yielded before their parent edge
+    stack = [(e, False) for e in reversed(root.edges)]
+    while len(stack) > 0:
+        edge, expanded = stack.pop()
+        if expanded:
+            yield edge
+            continue
+        stack.append((edge, True))
+        stack.extend((e, False) for e in reversed(edge.node_b.edges))
+
+
+####################################################################################
+#                                 COMPACT GRAPHS                                   #
+####################################################################################
+
+def _children_lists(dag):
+    offsets = dag.child_offsets.tolist()
+    children = dag.child_edges.tolist()
+    return [children[offsets[n]:offsets[n + 1]] for n in range(dag.number_of_nodes)]
+
+
+def parent_edges(dag):
+    # index of the edge entering node_a of every edge, -1 for edges leaving the root
+    incoming = np.full(dag.number_of_nodes, -1, dtype=np.int64)
+    incoming[dag.edge_node_b] = np.arange(dag.number_of_edges)
+    return incoming[dag.edge_node_a]
+
+
+def edge_preorder(dag):
+    children = _children_lists(dag)
+    node_b = dag.edge_node_b.tolist()
+    order = []
+    stack = children[dag.root_index][::-1]
+    while len(stack) > 0:
+        edge = stack.pop()
+        order.append(edge)
+        stack.extend(children[node_b[edge]][::-1])
+    return np.array(order, dtype=np.int64)
+
+
+def edge_postorder(dag):
+    children = _children_lists(dag)
+    node_b = dag.edge_node_b.tolist()
+    order = []
+    stack = [(e, False) for e in children[dag.root_index][::-1]]
+    while len(stack) > 0:
+        edge, expanded = stack.pop()
+        if expanded:
+            order.append(edge)
+            continue
+        stack.append((edge, True))
+        stack.extend((e, False) for e in children[node_b[edge]][::-1])
+    return np.array(order, dtype=np.int64)
+
+
+def node_preorder(dag):
+    preorder = edge_preorder(dag)
+    return np.concatenate([[dag.root_index], dag.edge_node_b[preorder]]).astype(np.int64)
+
+
+def edge_depths(dag, preorder=None):
+    preorder = edge_preorder(dag) if preorder is None else preorder
+    parents = parent_edges(dag).tolist()
+    depths = [0] * dag.number_of_edges
+    for edge in preorder.tolist():
+        parent = parents[edge]
+        depths[edge] = 0 if parent < 0 else depths[parent] + 1
+    return np.array(depths, dtype=np.int64)
+
+
+def edge_levels(dag):
+    # edges grouped by depth - levels[d] holds edges d steps below the root edges, in preorder within the level
+    preorder = edge_preorder(dag)
+    depths = edge_depths(dag, preorder)[preorder]
+    by_depth = preorder[np.argsort(depths, kind='stable')]
+    return np.split(by_depth, np.cumsum(np.bincount(depths))[:-1]) if len(preorder) > 0 else []
+
+
+def subtree_sizes(dag):
+    # number of edges in the subtree hanging from every edge, the edge included
+    parents = parent_edges(dag)
+    sizes = np.ones(dag.number_of_edges, dtype=np.int64)
+    for level in reversed(edge_levels(dag)):
+        level_parents = parents[level]
+        has_parent = level_parents >= 0
+        np.add.at(sizes, level_parents[has_parent], sizes[level[has_parent]])
+    return sizes
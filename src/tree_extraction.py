@@ -0,0 +1,172 @@
+import heapq
+import numpy as np
+from src.compact_dag import CompactDAG
+from src.graph_construction import polyline_ranks
+
+
+def incidence(number_of_nodes, edge_node_a, edge_node_b):
+    # CSR lists of edges incident to every node and of the nodes on their other ends, in edge order
+    # (the order of Node.edges after convert_to_nodes_list)
+    ends = np.stack([edge_node_a, edge_node_b], axis=1).ravel()
+    others = np.stack([edge_node_b, edge_node_a], axis=1).ravel()
+    order = np.argsort(ends, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(ends, minlength=number_of_nodes))])
+    return offsets, order // 2, others[order]
+
+
+def extract_tree(offsets, incident_edges, incident_nodes, radii, root):
+    # spanning tree grown from root like remove_dag_cycles of the final-3 notebooks: nodes are placed thickest
+    # first (ties in discovery order), each attached to the thinnest of its already placed neighbours (the first
+    # one placed among equals) through the first edge joining them; returns parent node and edge of every node
+    # (-1 for root and unreachable nodes) and nodes in placement order
+    number_of_nodes = len(offsets) - 1
+    parents = [-1] * number_of_nodes
+    parent_edges = [-1] * number_of_nodes
+    placed = [False] * number_of_nodes
+    discovered = [False] * number_of_nodes
+    radii = np.asarray(radii).tolist()
+    offsets, incident_edges, incident_nodes = np.asarray(offsets).tolist(), np.asarray(incident_edges).tolist(), np.asarray(incident_nodes).tolist()
+
+    order = []
+    queue = [(0, 0, root)]
+    discovered[root] = True
+    counter = 1
+    while queue:
+        _, _, node = heapq.heappop(queue)
+        placed[node] = True
+        order.append(node)
+
+        for i in range(offsets[node], offsets[node + 1]):
+            neighbour = incident_nodes[i]
+            if placed[neighbour]:
+                continue
+            parent = parents[neighbour]
+            if parent < 0 or radii[node] < radii[parent]:
+                parents[neighbour] = node
+                parent_edges[neighbour] = incident_edges[i]
+            if not discovered[neighbour]:
+                discovered[neighbour] = True
+                heapq.heappush(queue, (-radii[neighbour], counter, neighbour))
+                counter += 1
+
+    return np.array(parents, dtype=np.int64), np.array(parent_edges, dtype=np.int64), np.array(order, dtype=np.int64)
+
+
+def find_root_candidates(graph, root_degrees, thickness_tolerance):
+    # nodes of a SkeletonGraph with one of root_degrees edges, at most thickness_tolerance thinner than the
+    # thickest of them, listed in order of first appearance along the edges (like find_tree_root_candidates
+    # of the final-3 notebooks on the node list of convert_to_nodes_list)
+    ends = np.stack([graph.edge_node_a, graph.edge_node_b], axis=1).ravel()
+    _, first = np.unique(ends, return_index=True)
+    nodes = ends[np.sort(first)]
+    nodes = nodes[np.isin(np.bincount(ends, minlength=graph.number_of_nodes)[nodes], root_degrees)]
+    radii = graph.node_radii()[nodes]
+    return nodes[radii >= radii.max() - thickness_tolerance]
+
+
+def skeleton_tree(graph, root):
+    # tree of a SkeletonGraph rooted at node root, radii of nodes taken from their first voxels
+    offsets, incident_edges, incident_nodes = incidence(graph.number_of_nodes, graph.edge_node_a, graph.edge_node_b)
+    return extract_tree(offsets, incident_edges, incident_nodes, graph.node_radii(), root)
+
+
+def chain_heads(parents, order):
+    # kept nodes (root and nodes without exactly one child) and, for every other placed node, the first node of
+    # the chain of single-child nodes it belongs to - found by pointer jumping, a chain ends at its kept node
+    children_count = np.bincount(parents[order[1:]], minlength=len(parents))
+    kept = np.zeros(len(parents), dtype=bool)
+    kept[order] = children_count[order] != 1
+    kept[order[0]] = True
+
+    heads = np.arange(len(parents))
+    nodes = order[1:]
+    heads[nodes] = np.where(kept[parents[nodes]], nodes, parents[nodes])
+    while True:
+        jumped = heads[heads]
+        if np.array_equal(jumped, heads):
+            return kept, heads
+        heads = jumped
+
+
+def _ranges(starts, lengths, steps):
+    # concatenated starts[i] + steps[i] * arange(lengths[i])
+    begins = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    within = np.arange(np.sum(lengths)) - np.repeat(begins, lengths)
+    return np.repeat(starts, lengths) + np.repeat(np.broadcast_to(steps, len(lengths)), lengths) * within
+
+
+def compress_tree(graph, parents, parent_edges, order):
+    # CompactDAG of a SkeletonGraph tree with chains of single-child nodes merged into one edge, like
+    # remove_dag_redundant_nodes of the final-3 notebooks: a merged edge is gathered once from slices of the
+    # graph voxel buffers and ordered from its parent end; nodes and edges are numbered in depth first order
+    kept, heads = chain_heads(parents, order)
+    position = np.empty(len(parents), dtype=np.int64)
+    position[order] = np.arange(len(order))
+
+    # one merged edge per kept node except root, children of a node in placement order of chain heads
+    ends = order[1:][kept[order[1:]]]
+    starts = parents[heads[ends]]
+    by_parent = np.lexsort((position[heads[ends]], starts))
+    children = {}
+    for e in by_parent.tolist():
+        children.setdefault(int(starts[e]), []).append(e)
+
+    root = int(order[0])
+    node_order, edge_order = [root], []
+    stack = children.get(root, [])[::-1]
+    while stack:
+        e = stack.pop()
+        edge_order.append(e)
+        node_order.append(int(ends[e]))
+        stack.extend(children.get(int(ends[e]), [])[::-1])
+    node_order, edge_order = np.array(node_order, dtype=np.int64), np.array(edge_order, dtype=np.int64)
+    new_index = np.full(len(parents), -1, dtype=np.int64)
+    new_index[node_order] = np.arange(len(node_order))
+    edge_of_end = np.full(len(parents), -1, dtype=np.int64)
+    edge_of_end[ends[edge_order]] = np.arange(len(edge_order))
+
+    # chain members ordered by merged edge, then from the parent down; each brings its edge from the parent
+    # and, unless it is the end of the chain, its own voxels
+    members = order[1:]
+    chain_of_head = np.full(len(parents), -1, dtype=np.int64)
+    chain_of_head[heads[ends]] = edge_of_end[ends]
+    member_chains = chain_of_head[heads[members]]
+    members = members[np.lexsort((position[members], member_chains))]
+    member_chains = chain_of_head[heads[members]]
+
+    edges = parent_edges[members]
+    edge_lengths = np.diff(graph.edge_offsets)[edges]
+    node_lengths = np.where(kept[members], 0, np.diff(graph.node_offsets)[members])
+    segment_starts = np.stack([graph.edge_offsets[edges], graph.node_offsets[members] + len(graph.edge_voxels)], axis=1).ravel()
+    segment_lengths = np.stack([edge_lengths, node_lengths], axis=1).ravel()
+    sources = np.concatenate([graph.edge_voxels, graph.node_voxels])
+    voxels = sources[_ranges(segment_starts, segment_lengths, 1)]
+    chain_lengths = np.bincount(member_chains, weights=edge_lengths + node_lengths, minlength=len(edge_order)).astype(np.int64)
+    edge_offsets = np.concatenate([[0], np.cumsum(chain_lengths)]).astype(np.int64)
+
+    # merged edges ordered as polylines from their start nodes, so middle nodes are crossed from the voxels
+    # of the edge entering them to the ones of the edge leaving them
+    chains = np.repeat(np.arange(len(edge_order)), chain_lengths)
+    edge_of = np.full(len(graph.table), -1, dtype=np.int64)
+    edge_of[voxels] = chains
+    node_of = np.full(len(graph.table), -1, dtype=np.int64)
+    node_of[graph.node_voxels] = np.repeat(np.arange(graph.number_of_nodes), np.diff(graph.node_offsets))
+    ranks = polyline_ranks(graph.table, voxels, edge_of, node_of, starts[edge_order])
+    edge_voxels = graph.table.coords[voxels[np.lexsort((ranks, chains))]]
+
+    node_voxels = graph.node_voxels[_ranges(graph.node_offsets[node_order], np.diff(graph.node_offsets)[node_order], 1)]
+    node_offsets = np.concatenate([[0], np.cumsum(np.diff(graph.node_offsets)[node_order])]).astype(np.int64)
+
+    dag = CompactDAG(
+        node_coords=graph.node_coords()[node_order],
+        edge_node_a=new_index[starts[edge_order]],
+        edge_node_b=new_index[ends[edge_order]],
+        volume_shape=graph.shape,
+        root_index=0,
+        node_voxels=graph.table.coords[node_voxels],
+        node_voxel_offsets=node_offsets,
+        edge_voxels=edge_voxels,
+        edge_voxel_offsets=edge_offsets)
+    if graph.radii is not None:
+        dag.set_node_column('radius', graph.node_radii()[node_order])
+    return dag
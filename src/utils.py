@@ -1,29 +1,17 @@
-import pickle  
 import numpy as np    
+from src.traversal import iter_nodes_preorder, iter_edges_preorder
 
 def get_nodes_with_dfs(root):
-    nodes = [root]
-    for e in root.edges:
-        if e.node_a != root:
-            print(e)
-        nodes += get_nodes_with_dfs(e.node_b)
+    nodes = []
+    for node in iter_nodes_preorder(root):
+        for e in node.edges:
+            if e.node_a != node:
+                print(e)
+        nodes.append(node)
     return nodes
 
 def get_edges_with_dfs(root):
-    edges = []
-    for e in root.edges:
-        edges += [e]
-        edges += get_edges_with_dfs(e.node_b)
-    return edges
-
-def save_dag(dag, filename):
-    with open(filename, 'wb') as output:
-        pickle.dump(dag, output)
-        
-def load_dag(filename):
-    with open(filename, 'rb') as input_:
-        dag = pickle.load(input_)
-        return dag
+    return list(iter_edges_preorder(root))
 
 def calculate_direction(source, points, weights):
     if len(weights) > len(points):
@@ -34,11 +22,11 @@ def calculate_direction(source, points, weights):
     return direction / np.linalg.norm(direction)
 
 def calculate_vectors_relative_angle(v1, v2):
-    cosine = np.dot(v1,v2)
+    cosine = np.sum(np.multiply(v1, v2), axis=-1)
     return np.arccos(cosine)
 
 def generational_diff(a, b, max_angle, max_thick_diff):
     return (
-        b['relative_angle'] < max_angle and 
-        b['mean_radius'] > max_thick_diff * a['mean_radius']
+        (b['relative_angle'] < max_angle) & 
+        (b['mean_radius'] > max_thick_diff * a['mean_radius'])
     )
\ No newline at end of file
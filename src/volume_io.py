@@ -0,0 +1,74 @@
+import numpy as np
+
+PACKED_VOLUME_MAGIC = b'PACKVOL1'
+PACKED_VOLUME_HEADER_SIZE = len(PACKED_VOLUME_MAGIC) + 3 * 8
+
+
+class PackedVolume:
+    # boolean volume stored with 8 voxels per byte along the last axis, unpacked slab by slab
+    def __init__(self, packed, shape):
+        self.packed = packed
+        self.shape = tuple(int(s) for s in shape)
+        self.ndim = len(self.shape)
+        self.dtype = np.dtype(bool)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        rows = np.unpackbits(self.packed[index[0]], axis=-1, count=self.shape[-1]).astype(bool)
+        if len(index) == 1:
+            return rows
+        return rows[(slice(None),) + index[1:]] if rows.ndim == self.ndim else rows[index[1:]]
+
+    def __array__(self, dtype=None):
+        volume = self[:]
+        return volume if dtype is None else volume.astype(dtype)
+
+
+def save_packed_volume(filename, volume, slab_size=32):
+    if volume.ndim != 3:
+        raise ValueError(f'Only 3d volumes can be packed, got shape {volume.shape}')
+    with open(filename, 'wb') as output:
+        output.write(PACKED_VOLUME_MAGIC)
+        np.array(volume.shape, dtype='<i8').tofile(output)
+        for _, slab in iter_slabs(volume, slab_size):
+            np.packbits(slab, axis=-1).tofile(output)
+
+
+def is_packed_volume(filename):
+    with open(filename, 'rb') as input_:
+        return input_.read(len(PACKED_VOLUME_MAGIC)) == PACKED_VOLUME_MAGIC
+
+
+def load_packed_volume(filename, mmap_mode='r'):
+    with open(filename, 'rb') as input_:
+        if input_.read(len(PACKED_VOLUME_MAGIC)) != PACKED_VOLUME_MAGIC:
+            raise ValueError(f'{filename} is not a packed volume file')
+        shape = tuple(np.fromfile(input_, dtype='<i8', count=3))
+        packed_shape = shape[:-1] + ((shape[-1] + 7) // 8,)
+        if mmap_mode is None:
+            packed = np.fromfile(input_, dtype=np.uint8).reshape(packed_shape)
+            return PackedVolume(packed, shape)
+
+    packed = np.memmap(filename, dtype=np.uint8, mode=mmap_mode, offset=PACKED_VOLUME_HEADER_SIZE, shape=packed_shape)
+    return PackedVolume(packed, shape)
+
+
+def load_reconstruction(filename, mmap_mode=None):
+    if is_packed_volume(filename):
+        return load_packed_volume(filename, mmap_mode)
+    return np.load(filename, mmap_mode=mmap_mode)
+
+
+def iter_slabs(volume, slab_size=32, bounds=None):
+    # binary slabs along the first axis, so only slab_size planes are in memory at once
+    if bounds is None:
+        for start in range(0, volume.shape[0], slab_size):
+            yield start, np.asarray(volume[start:start + slab_size]) > 0
+        return
+    (z_min, y_min, x_min), (z_max, y_max, x_max) = bounds
+    for start in range(z_min, z_max, slab_size):
+        yield start, np.asarray(volume[start:min(start + slab_size, z_max)])[:, y_min:y_max, x_min:x_max] > 0
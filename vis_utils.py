@@ -15,14 +15,16 @@ def read_file_with_no_dims(file):
     return ct_scan
 
 
-def load_volume(file, scale=None):
-    raw_arr = np.fromfile(file, dtype=np.uint8)
+def load_volume(file, scale=None, mmap_mode=None):
     volume_dims_str = file.split('_')[-1].split('.')[0].split('x')
     
     if len(volume_dims_str) == 3:
         dims_order = (2, 1, 0)
         volume_dims = [int(volume_dims_str[i]) for i in dims_order]
-        arr = raw_arr.reshape(volume_dims)
+        if mmap_mode is not None:
+            arr = np.memmap(file, dtype=np.uint8, mode=mmap_mode, shape=tuple(volume_dims))
+        else:
+            arr = np.fromfile(file, dtype=np.uint8).reshape(volume_dims)
     else:
         arr = read_file_with_no_dims(file)
         